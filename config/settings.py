@@ -2,87 +2,134 @@
 Configuration settings for the AI Invoice Processing Agent
 """
 import os
+import re
+from functools import cached_property, lru_cache
 from pathlib import Path
-from typing import List
-from pydantic import Field
-from pydantic_settings import BaseSettings
+from typing import Any, Dict, FrozenSet, List, Pattern
 
+import msgspec
+from dotenv import dotenv_values
 
-class Settings(BaseSettings):
-    """Application settings with environment variable support"""
+
+class Settings(msgspec.Struct, frozen=True, kw_only=True, dict=True):
+    """Application settings with environment variable support
+    
+    Each field is read from the environment variable of the same name in
+    upper case (e.g. ``app_name`` -> ``APP_NAME``); see ``load_settings``.
+    """
     
     # Application Settings
-    app_name: str = Field(default="AI Invoice Processing Agent", env="APP_NAME")
-    app_version: str = Field(default="1.0.0", env="APP_VERSION")
-    debug: bool = Field(default=True, env="DEBUG")
-    host: str = Field(default="0.0.0.0", env="HOST")
-    port: int = Field(default=8000, env="PORT")
+    app_name: str = "AI Invoice Processing Agent"
+    app_version: str = "1.0.0"
+    debug: bool = True
+    host: str = "0.0.0.0"
+    port: int = 8000
     
     # Dashboard Settings
-    dashboard_port: int = Field(default=8501, env="DASHBOARD_PORT")
+    dashboard_port: int = 8501
     
     # File Processing Settings
-    incoming_folder: str = Field(default="./incoming", env="INCOMING_FOLDER")
-    generated_folder: str = Field(default="./generated", env="GENERATED_FOLDER")
-    log_folder: str = Field(default="./logs", env="LOG_FOLDER")
-    max_file_size_mb: int = Field(default=10, env="MAX_FILE_SIZE_MB")
-    supported_formats: str = Field(default="jpg,jpeg,png,pdf,tiff", env="SUPPORTED_FORMATS")
+    incoming_folder: str = "./incoming"
+    generated_folder: str = "./generated"
+    log_folder: str = "./logs"
+    max_file_size_mb: int = 10
+    supported_formats: str = "jpg,jpeg,png,pdf,tiff"
     
     # AI Model Settings
-    ollama_base_url: str = Field(default="http://localhost:11434", env="OLLAMA_BASE_URL")
-    ollama_model: str = Field(default="llama3.2-vision", env="OLLAMA_MODEL")
-    ai_processing_timeout_seconds: int = Field(default=1800, env="AI_PROCESSING_TIMEOUT_SECONDS")  # 30 minutes
-    ollama_request_timeout_seconds: int = Field(default=3600, env="OLLAMA_REQUEST_TIMEOUT_SECONDS")  # 60 minutes
+    ollama_base_url: str = "http://localhost:11434"
+    ollama_model: str = "llama3.2-vision"
+    ai_processing_timeout_seconds: int = 1800  # 30 minutes
+    ollama_request_timeout_seconds: int = 3600  # 60 minutes
     
     # Logging Settings
-    log_level: str = Field(default="INFO", env="LOG_LEVEL")
-    log_max_size_mb: int = Field(default=100, env="LOG_MAX_SIZE_MB")
-    log_backup_count: int = Field(default=5, env="LOG_BACKUP_COUNT")
+    log_level: str = "INFO"
+    log_max_size_mb: int = 100
+    log_backup_count: int = 5
     
     # Processing Settings
-    batch_size: int = Field(default=10, env="BATCH_SIZE")
-    processing_interval_seconds: int = Field(default=5, env="PROCESSING_INTERVAL_SECONDS")
-    max_retry_attempts: int = Field(default=3, env="MAX_RETRY_ATTEMPTS")
-    file_processing_timeout_seconds: int = Field(default=2400, env="FILE_PROCESSING_TIMEOUT_SECONDS")  # 40 minutes
+    batch_size: int = 10
+    processing_interval_seconds: int = 5
+    max_retry_attempts: int = 3
+    file_processing_timeout_seconds: int = 2400  # 40 minutes
+    max_worker_threads: int = 200  # threads for blocking I/O offload
+    worker_concurrency: int = 2  # concurrent queue consumers in the file monitor
+    max_results_cache: int = 10000  # processing results kept in memory
+    max_concurrent_llm_calls: int = 4  # files being extracted by the model at once
     
     # Database Settings
-    database_url: str = Field(default="sqlite:///./invoice_processing.db", env="DATABASE_URL")
+    database_url: str = "sqlite:///./invoice_processing.db"
     
-    class Config:
-        env_file = ".env"
-        case_sensitive = False
-    
-    @property
+    @cached_property
     def supported_formats_list(self) -> List[str]:
-        """Get supported file formats as a list"""
+        """Get supported file formats as a list (computed once)"""
         return [fmt.strip().lower() for fmt in self.supported_formats.split(",")]
     
+    @cached_property
+    def supported_formats_set(self) -> FrozenSet[str]:
+        """Get supported file formats as a set for fast membership checks"""
+        return frozenset(self.supported_formats_list)
+    
+    @cached_property
+    def supported_filename_pattern(self) -> Pattern[str]:
+        """Get a compiled pattern matching filenames with a supported extension"""
+        extensions = "|".join(re.escape(fmt) for fmt in self.supported_formats_list)
+        return re.compile(rf".+\.(?:{extensions})", re.IGNORECASE)
+    
     def get_absolute_path(self, relative_path: str) -> Path:
         """Convert relative path to absolute path"""
         return Path(relative_path).resolve()
     
-    @property
+    @cached_property
     def incoming_path(self) -> Path:
         """Get absolute path for incoming folder"""
         return self.get_absolute_path(self.incoming_folder)
     
-    @property
+    @cached_property
     def generated_path(self) -> Path:
         """Get absolute path for generated folder"""
         return self.get_absolute_path(self.generated_folder)
     
-    @property
+    @cached_property
     def log_path(self) -> Path:
         """Get absolute path for log folder"""
         return self.get_absolute_path(self.log_folder)
 
 
+# Boolean spellings accepted for bool settings (the same set pydantic accepts)
+_BOOL_STRINGS = {
+    **dict.fromkeys(("1", "on", "t", "true", "y", "yes"), True),
+    **dict.fromkeys(("0", "off", "f", "false", "n", "no"), False),
+}
+_BOOL_FIELDS = frozenset(field.name for field in msgspec.structs.fields(Settings) if field.type is bool)
+
+
+def load_settings(env_file: str = ".env") -> Settings:
+    """Load settings from the .env file and environment variables
+    
+    Environment variables take precedence over values in ``env_file``.
+    Variable names are matched case-insensitively; unknown names are ignored.
+    """
+    field_names = set(Settings.__struct_fields__)
+    values: Dict[str, Any] = {}
+    
+    for source in (dotenv_values(env_file), os.environ):
+        for key, value in source.items():
+            name = key.lower()
+            if name in field_names and value is not None:
+                if name in _BOOL_FIELDS:
+                    value = _BOOL_STRINGS.get(value.strip().lower(), value)
+                values[name] = value
+    
+    return msgspec.convert(values, Settings, strict=False)
+
+
 # Global settings instance
-settings = Settings()
+settings = load_settings()
 
 
+@lru_cache(maxsize=1)
 def ensure_directories():
-    """Ensure all required directories exist"""
+    """Ensure all required directories exist (runs once per process)"""
     directories = [
         settings.incoming_path,
         settings.generated_path,
@@ -92,7 +139,3 @@ def ensure_directories():
     for directory in directories:
         directory.mkdir(parents=True, exist_ok=True)
 
-
-# Ensure directories exist when module is imported
-ensure_directories()
-
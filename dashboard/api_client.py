@@ -0,0 +1,89 @@
+"""
+API client for the dashboard
+
+Streamlit re-executes app.py in a fresh namespace on every rerun, so state
+defined there is rebuilt each time. Imported modules are loaded once per
+process, so the HTTP session and response caches live here and are shared
+by all reruns and browser sessions.
+"""
+import threading
+from functools import lru_cache
+from typing import Any, Dict, Tuple
+
+import requests
+from cachetools import TTLCache, cached
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+API_BASE_URL = "http://localhost:8000"
+REFRESH_INTERVAL = 5  # seconds
+
+
+@lru_cache(maxsize=1)
+def get_session() -> requests.Session:
+    """Get a pooled HTTP session shared across reruns"""
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=16,
+        max_retries=Retry(total=2, backoff_factor=0.2, allowed_methods=["GET"])
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+# Last ETag and payload per endpoint, for conditional requests (kept across reruns
+# with the module, so an unchanged page comes back as a bodiless 304)
+_etag_cache: Dict[str, Tuple[str, Any]] = {}
+
+
+def fetch_api_data(endpoint: str):
+    """Fetch data from API, returning a (data, error) tuple"""
+    try:
+        cached_etag = _etag_cache.get(endpoint)
+        headers = {"If-None-Match": cached_etag[0]} if cached_etag else None
+        response = get_session().get(f"{API_BASE_URL}{endpoint}", headers=headers, timeout=10)
+        if response.status_code == 304 and cached_etag:
+            return cached_etag[1], None
+        if response.status_code == 200:
+            data = response.json()
+            etag = response.headers.get("ETag")
+            if etag:
+                _etag_cache[endpoint] = (etag, data)
+            return data, None
+        else:
+            return None, f"API Error: {response.status_code}"
+    except requests.exceptions.RequestException as e:
+        return None, f"Connection Error: {str(e)}"
+
+
+@cached(TTLCache(maxsize=1, ttl=60), lock=threading.RLock())
+def fetch_health():
+    """Fetch system health"""
+    return fetch_api_data("/")
+
+
+@cached(TTLCache(maxsize=1, ttl=10), lock=threading.RLock())
+def fetch_stats():
+    """Fetch processing statistics"""
+    return fetch_api_data("/stats")
+
+
+@cached(TTLCache(maxsize=8, ttl=REFRESH_INTERVAL), lock=threading.RLock())
+def fetch_results(limit: int):
+    """Fetch recent processing results"""
+    return fetch_api_data(f"/results?limit={limit}")
+
+
+@cached(TTLCache(maxsize=1, ttl=300), lock=threading.RLock())
+def fetch_status():
+    """Fetch system status (settings and uptime change rarely)"""
+    return fetch_api_data("/status")
+
+
+def clear_live_caches():
+    """Invalidate cached data that changes as files are processed"""
+    fetch_health.cache_clear()
+    fetch_stats.cache_clear()
+    fetch_results.cache_clear()
@@ -2,15 +2,16 @@
 Streamlit Dashboard for AI Invoice Processing Agent
 """
 import streamlit as st
-import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
-import requests
-import time
-from datetime import datetime, timedelta
-import json
-from pathlib import Path
+import html
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from datetime import datetime
+
+# Imported rather than defined here so caches survive Streamlit reruns
+from api_client import (
+    API_BASE_URL, clear_live_caches, fetch_health, fetch_results,
+    fetch_stats, fetch_status, get_session
+)
 
 # Page configuration
 st.set_page_config(
@@ -56,109 +57,115 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # Configuration
-API_BASE_URL = "http://localhost:8000"
-REFRESH_INTERVAL = 5  # seconds
+RESULTS_LIMIT = 20
+CHART_CACHE_ENTRIES = 32
 
 
-@st.cache_data(ttl=30)
-def fetch_api_data(endpoint: str):
-    """Fetch data from API with caching"""
-    try:
-        response = requests.get(f"{API_BASE_URL}{endpoint}", timeout=10)
-        if response.status_code == 200:
-            return response.json()
-        else:
-            st.error(f"API Error: {response.status_code}")
-            return None
-    except requests.exceptions.RequestException as e:
-        st.error(f"Connection Error: {str(e)}")
-        return None
+def fetch_all():
+    """Fetch live dashboard data concurrently, keyed by section"""
+    fetchers = {
+        "health": fetch_health,
+        "stats": fetch_stats,
+        "results": lambda: fetch_results(RESULTS_LIMIT),
+    }
+    
+    with ThreadPoolExecutor(max_workers=len(fetchers)) as executor:
+        futures = {name: executor.submit(fetcher) for name, fetcher in fetchers.items()}
+    return {name: future.result() for name, future in futures.items()}
 
 
-def get_status_color(status: str) -> str:
-    """Get color for status"""
-    colors = {
-        "success": "#28a745",
-        "failed": "#dc3545",
-        "processing": "#ffc107",
-        "pending": "#6c757d"
-    }
-    return colors.get(status.lower(), "#6c757d")
+def unwrap_response(response):
+    """Get data from a (data, error) fetch result, reporting errors"""
+    data, error = response
+    if error:
+        st.error(error)
+    return data
 
 
-def format_status(status: str) -> str:
-    """Format status with color"""
-    color = get_status_color(status)
-    return f'<span style="color: {color}; font-weight: bold;">{status.upper()}</span>'
+@st.cache_data(ttl=60)
+def results_to_csv(results: list) -> bytes:
+    """Serialize processing results to CSV (cached while the results are unchanged)"""
+    import pandas as pd
+    
+    return pd.DataFrame(results).to_csv(index=False).encode()
 
 
-def main():
-    """Main dashboard function"""
+@lru_cache(maxsize=256)
+def parse_iso_timestamp(timestamp: str) -> datetime:
+    """Parse an API ISO timestamp (cached, as it repeats across refreshes)"""
+    return datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+
+
+# Status colors and the pre-rendered status cells for the results table
+STATUS_COLORS = {
+    "success": "#28a745",
+    "failed": "#dc3545",
+    "processing": "#ffc107",
+    "pending": "#6c757d"
+}
+STATUS_HTML = {
+    status: f'<span style="color: {color}; font-weight: bold;">{status.upper()}</span>'
+    for status, color in STATUS_COLORS.items()
+}
+
+
+@st.cache_data(max_entries=CHART_CACHE_ENTRIES)
+def results_pie_chart(successful: int, failed: int):
+    """Build the processing results pie chart"""
+    import plotly.express as px
     
-    # Header
-    st.markdown('<h1 class="main-header">🤖 AI Invoice Processing Dashboard</h1>', unsafe_allow_html=True)
+    labels = ['Successful', 'Failed']
+    values = [successful, failed]
+    colors = ['#28a745', '#dc3545']
+
+    fig = px.pie(
+        values=values,
+        names=labels,
+        title="Processing Results Distribution",
+        color_discrete_sequence=colors
+    )
+    fig.update_traces(textposition='inside', textinfo='percent+label')
+    return fig
+
+
+@st.cache_data(max_entries=CHART_CACHE_ENTRIES)
+def success_rate_gauge(success_rate: float):
+    """Build the success rate gauge"""
+    import plotly.graph_objects as go
     
-    # Sidebar
-    with st.sidebar:
-        st.header("⚙️ Controls")
-        
-        # Auto-refresh toggle
-        auto_refresh = st.checkbox("Auto Refresh", value=True)
-        
-        if auto_refresh:
-            refresh_rate = st.selectbox(
-                "Refresh Rate (seconds)",
-                [5, 10, 30, 60],
-                index=0
-            )
-        
-        st.divider()
-        
-        # Manual actions
-        st.header("🔧 Actions")
-        
-        if st.button("🔄 Refresh Now"):
-            st.cache_data.clear()
-            st.rerun()
-        
-        if st.button("▶️ Trigger Processing"):
-            try:
-                response = requests.post(f"{API_BASE_URL}/process")
-                if response.status_code == 200:
-                    st.success("Processing triggered successfully!")
-                else:
-                    st.error("Failed to trigger processing")
-            except Exception as e:
-                st.error(f"Error: {str(e)}")
-        
-        st.divider()
-        
-        # File upload
-        st.header("📁 Upload Invoice")
-        uploaded_file = st.file_uploader(
-            "Choose an invoice file",
-            type=['jpg', 'jpeg', 'png', 'pdf', 'tiff'],
-            help="Upload an invoice image for processing"
-        )
-        
-        if uploaded_file is not None:
-            if st.button("📤 Upload & Process"):
-                try:
-                    files = {"file": uploaded_file}
-                    response = requests.post(f"{API_BASE_URL}/upload", files=files)
-                    if response.status_code == 200:
-                        st.success("File uploaded successfully!")
-                        st.cache_data.clear()
-                    else:
-                        st.error("Failed to upload file")
-                except Exception as e:
-                    st.error(f"Error: {str(e)}")
+    fig = go.Figure(go.Indicator(
+        mode="gauge+number+delta",
+        value=success_rate,
+        domain={'x': [0, 1], 'y': [0, 1]},
+        title={'text': "Success Rate"},
+        delta={'reference': 95},
+        gauge={
+            'axis': {'range': [None, 100]},
+            'bar': {'color': "darkblue"},
+            'steps': [
+                {'range': [0, 50], 'color': "lightgray"},
+                {'range': [50, 80], 'color': "yellow"},
+                {'range': [80, 100], 'color': "lightgreen"}
+            ],
+            'threshold': {
+                'line': {'color': "red", 'width': 4},
+                'thickness': 0.75,
+                'value': 90
+            }
+        }
+    ))
+    fig.update_layout(height=300)
+    return fig
+
+
+def render_live_sections():
+    """Render the health, statistics and results sections"""
+    responses = fetch_all()
     
-    # Main content
     # System Status
     st.header("🏥 System Health")
     
-    health_data = fetch_api_data("/")
+    health_data = unwrap_response(responses["health"])
     if health_data:
         col1, col2, col3, col4 = st.columns(4)
         
@@ -176,7 +183,7 @@ def main():
         with col4:
             timestamp = health_data.get("timestamp", "")
             if timestamp:
-                last_check = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+                last_check = parse_iso_timestamp(timestamp)
                 st.metric("Last Check", last_check.strftime("%H:%M:%S"))
     
     st.divider()
@@ -184,7 +191,7 @@ def main():
     # Processing Statistics
     st.header("📊 Processing Statistics")
     
-    stats_data = fetch_api_data("/stats")
+    stats_data = unwrap_response(responses["stats"])
     if stats_data:
         col1, col2, col3, col4, col5 = st.columns(5)
         
@@ -237,59 +244,32 @@ def main():
             
             with col1:
                 # Pie chart for processing results
-                labels = ['Successful', 'Failed']
-                values = [stats_data.get("successful", 0), stats_data.get("failed", 0)]
-                colors = ['#28a745', '#dc3545']
-                
-                fig = px.pie(
-                    values=values,
-                    names=labels,
-                    title="Processing Results Distribution",
-                    color_discrete_sequence=colors
-                )
-                fig.update_traces(textposition='inside', textinfo='percent+label')
+                fig = results_pie_chart(stats_data.get("successful", 0), stats_data.get("failed", 0))
                 st.plotly_chart(fig, use_container_width=True)
             
             with col2:
                 # Success rate gauge
-                fig = go.Figure(go.Indicator(
-                    mode="gauge+number+delta",
-                    value=success_rate,
-                    domain={'x': [0, 1], 'y': [0, 1]},
-                    title={'text': "Success Rate"},
-                    delta={'reference': 95},
-                    gauge={
-                        'axis': {'range': [None, 100]},
-                        'bar': {'color': "darkblue"},
-                        'steps': [
-                            {'range': [0, 50], 'color': "lightgray"},
-                            {'range': [50, 80], 'color': "yellow"},
-                            {'range': [80, 100], 'color': "lightgreen"}
-                        ],
-                        'threshold': {
-                            'line': {'color': "red", 'width': 4},
-                            'thickness': 0.75,
-                            'value': 90
-                        }
-                    }
-                ))
-                fig.update_layout(height=300)
-                st.plotly_chart(fig, use_container_width=True)
+                st.plotly_chart(success_rate_gauge(success_rate), use_container_width=True)
     
     st.divider()
     
     # Recent Processing Results
     st.header("📋 Recent Processing Results")
     
-    results_data = fetch_api_data("/results?limit=20")
+    results_data = unwrap_response(responses["results"])
     if results_data and isinstance(results_data, list):
         if results_data:
+            import pandas as pd
+            
             # Convert to DataFrame
             df = pd.DataFrame(results_data)
+            df['created_at'] = pd.to_datetime(
+                df['created_at'], format='ISO8601', utc=True, cache=True, errors='coerce'
+            )
             
             # Format data for display
             display_df = df.copy()
-            display_df['created_at'] = pd.to_datetime(display_df['created_at']).dt.strftime('%Y-%m-%d %H:%M:%S')
+            display_df['created_at'] = display_df['created_at'].dt.strftime('%Y-%m-%d %H:%M:%S')
             display_df['processing_time'] = display_df['processing_time'].apply(
                 lambda x: f"{x:.2f}s" if pd.notna(x) else "N/A"
             )
@@ -308,41 +288,103 @@ def main():
                 'Created At', 'Error Message'
             ]
             
-            # Style the dataframe
-            def style_status(val):
-                if val.lower() == 'success':
-                    return 'color: #28a745; font-weight: bold'
-                elif val.lower() == 'failed':
-                    return 'color: #dc3545; font-weight: bold'
-                elif val.lower() == 'processing':
-                    return 'color: #ffc107; font-weight: bold'
-                else:
-                    return 'color: #6c757d; font-weight: bold'
-            
-            styled_df = display_df.style.applymap(style_status, subset=['Status'])
+            # Render status badges from a lookup table; escape free-text columns
+            # since the table is rendered as raw HTML
+            for column in ('Original File', 'Error Message'):
+                display_df[column] = display_df[column].astype(str).map(html.escape)
+            statuses = display_df['Status'].astype(str)
+            display_df['Status'] = statuses.str.lower().map(STATUS_HTML).fillna(statuses.map(html.escape))
             
-            st.dataframe(
-                styled_df,
-                use_container_width=True,
-                height=400
+            table_html = display_df.to_html(escape=False, index=False)
+            st.markdown(
+                f'<div style="max-height: 400px; overflow-y: auto;">{table_html}</div>',
+                unsafe_allow_html=True
             )
             
             # Download results as CSV
-            csv = df.to_csv(index=False)
             st.download_button(
                 label="📥 Download Results as CSV",
-                data=csv,
+                data=results_to_csv(results_data),
                 file_name=f"invoice_processing_results_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
                 mime="text/csv"
             )
         else:
             st.info("No processing results available yet.")
+
+
+def main():
+    """Main dashboard function"""
+    
+    # Header
+    st.markdown('<h1 class="main-header">🤖 AI Invoice Processing Dashboard</h1>', unsafe_allow_html=True)
+    
+    # Sidebar
+    with st.sidebar:
+        st.header("⚙️ Controls")
+        
+        # Auto-refresh toggle
+        auto_refresh = st.checkbox("Auto Refresh", value=True)
+        
+        if auto_refresh:
+            refresh_rate = st.selectbox(
+                "Refresh Rate (seconds)",
+                [5, 10, 30, 60],
+                index=0
+            )
+        
+        st.divider()
+        
+        # Manual actions
+        st.header("🔧 Actions")
+        
+        if st.button("🔄 Refresh Now"):
+            clear_live_caches()
+            st.rerun()
+        
+        if st.button("▶️ Trigger Processing"):
+            try:
+                response = get_session().post(f"{API_BASE_URL}/process")
+                if response.status_code == 200:
+                    st.success("Processing triggered successfully!")
+                else:
+                    st.error("Failed to trigger processing")
+            except Exception as e:
+                st.error(f"Error: {str(e)}")
+        
+        st.divider()
+        
+        # File upload
+        st.header("📁 Upload Invoice")
+        uploaded_file = st.file_uploader(
+            "Choose an invoice file",
+            type=['jpg', 'jpeg', 'png', 'pdf', 'tiff'],
+            help="Upload an invoice image for processing"
+        )
+        
+        if uploaded_file is not None:
+            if st.button("📤 Upload & Process"):
+                try:
+                    files = {"file": uploaded_file}
+                    response = get_session().post(f"{API_BASE_URL}/upload", files=files)
+                    if response.status_code == 200:
+                        st.success("File uploaded successfully!")
+                        fetch_stats.cache_clear()
+                        fetch_results.cache_clear()
+                    else:
+                        st.error("Failed to upload file")
+                except Exception as e:
+                    st.error(f"Error: {str(e)}")
+    
+    # Main content
+    # Live sections re-run on their own timer without rerunning the whole script
+    run_every = refresh_rate if auto_refresh else None
+    st.fragment(run_every=run_every)(render_live_sections)()
     
     st.divider()
     
     # System Information
     with st.expander("🔍 System Information", expanded=False):
-        status_data = fetch_api_data("/status")
+        status_data = unwrap_response(fetch_status())
         if status_data and status_data.get("success"):
             data = status_data.get("data", {})
             
@@ -358,11 +400,6 @@ def main():
                 st.subheader("Uptime")
                 uptime = data.get("uptime", "Unknown")
                 st.text(f"System Uptime: {uptime}")
-    
-    # Auto-refresh
-    if auto_refresh:
-        time.sleep(refresh_rate)
-        st.rerun()
 
 
 if __name__ == "__main__":
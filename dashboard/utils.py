@@ -1,12 +1,25 @@
 """
 Dashboard utilities and helper functions
 """
+import os
+import re
 import streamlit as st
-import requests
-from typing import Dict, Any, Optional
-import plotly.graph_objects as go
-import plotly.express as px
-from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+
+# Number of distinct inputs each chart builder keeps cached figures for
+CHART_CACHE_ENTRIES = 32
+
+# Seconds folder statistics are reused while the folders look unchanged
+# (a file rewritten in place does not touch its folder's mtime)
+FOLDER_STATS_TTL = 5
+
+# Error types and the keywords that identify them, in priority order
+_ERROR_RULES = (
+    ('Timeout', re.compile('timeout')),
+    ('Format Error', re.compile('format|unsupported')),
+    ('File Size', re.compile('size')),
+    ('Parsing Error', re.compile('json|parse')),
+)
 
 
 def create_metric_card(title: str, value: str, delta: Optional[str] = None, help_text: Optional[str] = None):
@@ -40,19 +53,40 @@ def create_status_badge(status: str) -> str:
     return f'<span style="background-color: {color}; color: white; padding: 0.2rem 0.5rem; border-radius: 0.3rem; font-size: 0.8rem; font-weight: bold;">{status.upper()}</span>'
 
 
+@st.cache_data(max_entries=CHART_CACHE_ENTRIES)
 def create_processing_timeline_chart(results_data):
     """Create a timeline chart of processing results"""
     if not results_data:
         return None
     
+    import numpy as np
     import pandas as pd
+    import plotly.express as px
     
     df = pd.DataFrame(results_data)
-    df['created_at'] = pd.to_datetime(df['created_at'])
-    df['hour'] = df['created_at'].dt.floor('H')
+    if not pd.api.types.is_datetime64_any_dtype(df['created_at']):
+        df['created_at'] = pd.to_datetime(
+            df['created_at'], format='ISO8601', utc=True, cache=True, errors='coerce'
+        )
+    # Drop rows without a time or status (factorize would code a missing status as -1,
+    # which np.add.at counts against the last status)
+    df = df.dropna(subset=['created_at', 'status'])
+    if df.empty:
+        return None
     
-    # Group by hour and status
-    timeline_data = df.groupby(['hour', 'status']).size().reset_index(name='count')
+    # Count files per (hour, status) cell by truncating timestamps to the hour
+    hours = df['created_at'].values.astype('datetime64[h]')
+    hour_values, hour_codes = np.unique(hours, return_inverse=True)
+    status_codes, status_values = pd.factorize(df['status'], sort=True)
+    counts = np.zeros((len(hour_values), len(status_values)), dtype=np.int64)
+    np.add.at(counts, (hour_codes, status_codes), 1)
+    
+    hour_idx, status_idx = np.nonzero(counts)
+    timeline_data = pd.DataFrame({
+        'hour': hour_values[hour_idx],
+        'status': status_values[status_idx],
+        'count': counts[hour_idx, status_idx]
+    })
     
     fig = px.bar(
         timeline_data,
@@ -77,12 +111,14 @@ def create_processing_timeline_chart(results_data):
     return fig
 
 
+@st.cache_data(max_entries=CHART_CACHE_ENTRIES)
 def create_processing_time_chart(results_data):
     """Create a chart showing processing time distribution"""
     if not results_data:
         return None
     
     import pandas as pd
+    import plotly.express as px
     
     df = pd.DataFrame(results_data)
     successful_results = df[df['status'] == 'success']
@@ -107,13 +143,6 @@ def create_processing_time_chart(results_data):
     return fig
 
 
-def create_file_size_chart(results_data):
-    """Create a chart showing file size vs processing time"""
-    # This would require file size data to be included in results
-    # For now, return None as placeholder
-    return None
-
-
 def format_uptime(uptime_str: str) -> str:
     """Format uptime string for better display"""
     try:
@@ -144,12 +173,15 @@ def get_system_health_color(services: Dict[str, str]) -> str:
         return "#dc3545"  # Red for mostly unhealthy
 
 
+@st.cache_data(max_entries=CHART_CACHE_ENTRIES)
 def create_error_analysis_chart(results_data):
     """Create a chart analyzing error types"""
     if not results_data:
         return None
     
+    import numpy as np
     import pandas as pd
+    import plotly.express as px
     
     df = pd.DataFrame(results_data)
     failed_results = df[df['status'] == 'failed']
@@ -157,22 +189,12 @@ def create_error_analysis_chart(results_data):
     if failed_results.empty:
         return None
     
-    # Extract error types from error messages
-    error_types = []
-    for error_msg in failed_results['error_message'].fillna('Unknown Error'):
-        if 'timeout' in error_msg.lower():
-            error_types.append('Timeout')
-        elif 'format' in error_msg.lower() or 'unsupported' in error_msg.lower():
-            error_types.append('Format Error')
-        elif 'size' in error_msg.lower():
-            error_types.append('File Size')
-        elif 'json' in error_msg.lower() or 'parse' in error_msg.lower():
-            error_types.append('Parsing Error')
-        else:
-            error_types.append('Other')
-    
-    error_df = pd.DataFrame({'error_type': error_types})
-    error_counts = error_df['error_type'].value_counts()
+    # Classify error types from error messages (first matching rule wins)
+    messages = failed_results['error_message'].fillna('Unknown Error').str.lower()
+    conditions = [messages.str.contains(pattern) for _, pattern in _ERROR_RULES]
+    labels = [label for label, _ in _ERROR_RULES]
+    error_types = pd.Series(np.select(conditions, labels, default='Other'))
+    error_counts = error_types.value_counts()
     
     fig = px.pie(
         values=error_counts.values,
@@ -183,33 +205,52 @@ def create_error_analysis_chart(results_data):
     return fig
 
 
-@st.cache_data(ttl=60)
+# This would need to be configured based on actual folder paths
+INCOMING_FOLDER = "./incoming"
+GENERATED_FOLDER = "./generated"
+
+
+def _folder_stat(path: str) -> Tuple[int, float]:
+    """Count files and their total size in MB with a single scandir pass"""
+    count, size = 0, 0
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_file(follow_symlinks=False):
+                count += 1
+                size += entry.stat(follow_symlinks=False).st_size
+    return count, size / (1024 * 1024)
+
+
+def _folder_mtime(path: str) -> Optional[int]:
+    """Get folder modification time in nanoseconds, or None if it does not exist"""
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
 def get_folder_stats():
     """Get statistics about incoming and generated folders"""
+    # Folder mtimes change when files are added or removed, so they key the cache
+    return _get_folder_stats(_folder_mtime(INCOMING_FOLDER), _folder_mtime(GENERATED_FOLDER))
+
+
+@st.cache_data(ttl=FOLDER_STATS_TTL)
+def _get_folder_stats(incoming_mtime: Optional[int], generated_mtime: Optional[int]):
+    """Compute folder statistics (cached per folder mtime, for FOLDER_STATS_TTL seconds)"""
+    stats = {
+        "incoming_files": 0,
+        "generated_files": 0,
+        "incoming_size_mb": 0,
+        "generated_size_mb": 0
+    }
+    
     try:
-        from pathlib import Path
-        import os
-        
-        # This would need to be configured based on actual folder paths
-        incoming_path = Path("./incoming")
-        generated_path = Path("./generated")
-        
-        stats = {
-            "incoming_files": 0,
-            "generated_files": 0,
-            "incoming_size_mb": 0,
-            "generated_size_mb": 0
-        }
-        
-        if incoming_path.exists():
-            incoming_files = list(incoming_path.glob("*"))
-            stats["incoming_files"] = len([f for f in incoming_files if f.is_file()])
-            stats["incoming_size_mb"] = sum(f.stat().st_size for f in incoming_files if f.is_file()) / (1024 * 1024)
+        if incoming_mtime is not None:
+            stats["incoming_files"], stats["incoming_size_mb"] = _folder_stat(INCOMING_FOLDER)
         
-        if generated_path.exists():
-            generated_files = list(generated_path.glob("*"))
-            stats["generated_files"] = len([f for f in generated_files if f.is_file()])
-            stats["generated_size_mb"] = sum(f.stat().st_size for f in generated_files if f.is_file()) / (1024 * 1024)
+        if generated_mtime is not None:
+            stats["generated_files"], stats["generated_size_mb"] = _folder_stat(GENERATED_FOLDER)
         
         return stats
     except Exception:
@@ -219,4 +260,3 @@ def get_folder_stats():
             "incoming_size_mb": 0,
             "generated_size_mb": 0
         }
-
@@ -3,21 +3,28 @@ FastAPI main application module
 """
 import asyncio
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
-from datetime import datetime
-from typing import Dict, Any, List
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import BinaryIO, Dict, Any, List, Optional, Tuple
 
-from fastapi import FastAPI, HTTPException, BackgroundTasks, UploadFile, File
+import anyio.to_thread
+
+from fastapi import FastAPI, HTTPException, BackgroundTasks, UploadFile, File, Header, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
+from pydantic import TypeAdapter
 
-from config.settings import settings
+from config.settings import settings, ensure_directories
 from src.models import (
     APIResponse, SystemStats, ProcessingRequest, 
     HealthCheck, LogEntry, ProcessingResult
 )
 from src.services.invoice_processor import InvoiceProcessorService
 from src.services.file_monitor import FileMonitorService
+from src.utils.helpers import BufferPool, create_unique_file, is_supported_format
 from src.utils.logger import get_logger
 
 # Initialize logger
@@ -26,7 +33,11 @@ logger = get_logger(__name__)
 # Global services
 invoice_processor: InvoiceProcessorService = None
 file_monitor: FileMonitorService = None
-app_start_time = datetime.utcnow()
+app_start_monotonic = time.monotonic()
+
+# Reusable buffers for streaming uploads to disk
+UPLOAD_CHUNK_SIZE = 1 << 20  # 1 MiB
+upload_buffers = BufferPool(UPLOAD_CHUNK_SIZE, max_buffers=8)
 
 
 @asynccontextmanager
@@ -36,6 +47,14 @@ async def lifespan(app: FastAPI):
     
     logger.info("Starting AI Invoice Processing Agent...")
     
+    ensure_directories()
+    
+    # Size the thread pools used for blocking I/O (sync routes and to_thread)
+    anyio.to_thread.current_default_thread_limiter().total_tokens = settings.max_worker_threads
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=settings.max_worker_threads)
+    )
+    
     # Initialize services
     invoice_processor = InvoiceProcessorService()
     file_monitor = FileMonitorService(invoice_processor)
@@ -59,6 +78,7 @@ app = FastAPI(
     title=settings.app_name,
     version=settings.app_version,
     description="Enterprise AI agent for automated invoice processing",
+    default_response_class=ORJSONResponse,
     lifespan=lifespan
 )
 
@@ -72,23 +92,30 @@ app.add_middleware(
 )
 
 
+def _format_uptime() -> str:
+    """Format time since startup like str(timedelta), e.g. '1 day, 2:03:04.5'"""
+    return str(timedelta(seconds=time.monotonic() - app_start_monotonic))
+
+
+# Health check fields that never change while the process runs
+_HEALTH_BASE = {"status": "healthy", "version": settings.app_version}
+
+
 @app.get("/", response_model=HealthCheck)
 async def health_check():
     """Health check endpoint"""
-    uptime = datetime.utcnow() - app_start_time
-    
     services_status = {
         "invoice_processor": "healthy" if invoice_processor else "unavailable",
         "file_monitor": "healthy" if file_monitor and file_monitor.is_running else "stopped",
         "ai_model": "healthy"  # TODO: Add actual AI model health check
     }
     
-    return HealthCheck(
-        status="healthy",
-        version=settings.app_version,
-        timestamp=datetime.utcnow(),
-        services=services_status
-    )
+    # Serialize directly; response_model only documents the shape for OpenAPI
+    return ORJSONResponse({
+        **_HEALTH_BASE,
+        "timestamp": datetime.now(timezone.utc),
+        "services": services_status
+    })
 
 
 @app.get("/status", response_model=APIResponse)
@@ -96,11 +123,11 @@ async def get_system_status():
     """Get detailed system status"""
     try:
         stats = await get_processing_stats()
-        uptime = str(datetime.utcnow() - app_start_time)
+        uptime = _format_uptime()
         
         status_data = {
             "uptime": uptime,
-            "stats": stats.dict(),
+            "stats": stats.model_dump(),
             "settings": {
                 "incoming_folder": str(settings.incoming_path),
                 "generated_folder": str(settings.generated_path),
@@ -117,7 +144,7 @@ async def get_system_status():
             data=status_data
         )
     except Exception as e:
-        logger.error(f"Error getting system status: {str(e)}")
+        logger.error("Error getting system status: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 
@@ -129,12 +156,15 @@ async def get_processing_stats():
             raise HTTPException(status_code=503, detail="Invoice processor not available")
         
         stats = await invoice_processor.get_statistics()
-        uptime = str(datetime.utcnow() - app_start_time)
-        stats.uptime = uptime
+        stats.uptime = _format_uptime()
+        
+        if file_monitor:
+            stats.queue_size = file_monitor.get_queue_size()
+            stats.dropped_files = file_monitor.get_dropped_count()
         
         return stats
     except Exception as e:
-        logger.error(f"Error getting processing stats: {str(e)}")
+        logger.error("Error getting processing stats: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 
@@ -158,12 +188,32 @@ async def trigger_processing(
         return APIResponse(
             success=True,
             message="Processing triggered successfully",
-            data={"request": request.dict()}
+            data={"request": request.model_dump()}
         )
     except Exception as e:
-        logger.error(f"Error triggering processing: {str(e)}")
+        logger.error("Error triggering processing: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
+
+def _save_upload(source: BinaryIO, file_path: Path) -> Tuple[Path, int]:
+    """Copy an uploaded file to disk, returning the saved path and its size"""
+    # Create the file exclusively, renaming on duplicate filenames
+    file_path, target = create_unique_file(file_path)
+    
+    # Stream uploaded file to disk in chunks
+    source.seek(0)
+    buffer = upload_buffers.get()
+    size = 0
+    try:
+        with target:
+            while count := source.readinto(buffer):
+                target.write(buffer[:count])
+                size += count
+    finally:
+        upload_buffers.put(buffer)
+    return file_path, size
+
+
 @app.post("/upload", response_model=APIResponse)
 async def upload_invoice(
     background_tasks: BackgroundTasks,
@@ -175,30 +225,18 @@ async def upload_invoice(
             raise HTTPException(status_code=400, detail="No filename provided")
         
         # Check file format
-        file_extension = file.filename.split('.')[-1].lower()
-        if file_extension not in settings.supported_formats_list:
+        if not is_supported_format(file.filename, settings.supported_formats_set):
             raise HTTPException(
                 status_code=400, 
                 detail=f"Unsupported file format. Supported: {settings.supported_formats_list}"
             )
         
-        # Save file to incoming folder
-        file_path = settings.incoming_path / file.filename
-        
-        # Handle duplicate filenames
-        counter = 1
-        original_path = file_path
-        while file_path.exists():
-            name_parts = original_path.stem, counter, original_path.suffix
-            file_path = original_path.parent / f"{name_parts[0]}_{name_parts[1]}{name_parts[2]}"
-            counter += 1
-        
-        # Save uploaded file
-        with open(file_path, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
+        # Save file to incoming folder, off the event loop
+        file_path, size = await asyncio.to_thread(
+            _save_upload, file.file, settings.incoming_path / file.filename
+        )
         
-        logger.info(f"File uploaded successfully: {file_path}")
+        logger.info("File uploaded successfully: %s", file_path)
         
         # Trigger background processing (don't wait for completion)
         if invoice_processor:
@@ -212,27 +250,54 @@ async def upload_invoice(
             message="File uploaded successfully and queued for processing",
             data={
                 "filename": file_path.name, 
-                "size": len(content),
+                "size": size,
                 "status": "queued_for_processing",
                 "note": "Processing will happen in background. Check /results endpoint for status."
             }
         )
     except Exception as e:
-        logger.error(f"Error uploading file: {str(e)}")
+        logger.error("Error uploading file: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# Serializer for /results, built once instead of per request
+results_adapter = TypeAdapter(List[ProcessingResult])
+
+
+def _results_etag(results: List[ProcessingResult]) -> str:
+    """Build an ETag for a page of results from its update times and size"""
+    if not results:
+        return '"0"'
+    stamps = [int(result.updated_at.timestamp() * 1_000_000) for result in results]
+    # Newest catches updates, oldest catches rows sliding into a full page
+    return f'"{max(stamps):x}-{min(stamps):x}-{len(results):x}"'
+
+
 @app.get("/results", response_model=List[ProcessingResult])
-async def get_processing_results(limit: int = 50):
+async def get_processing_results(
+    limit: int = 50,
+    if_none_match: Optional[str] = Header(None)
+):
     """Get recent processing results"""
     try:
         if not invoice_processor:
             raise HTTPException(status_code=503, detail="Invoice processor not available")
         
         results = await invoice_processor.get_recent_results(limit)
-        return results
+        
+        # Let clients skip re-downloading an unchanged page
+        etag = _results_etag(results)
+        if if_none_match == etag:
+            return Response(status_code=304, headers={"ETag": etag})
+        
+        # Serialize the whole list in one pass with the precompiled adapter
+        return Response(
+            content=results_adapter.dump_json(results),
+            media_type="application/json",
+            headers={"ETag": etag}
+        )
     except Exception as e:
-        logger.error(f"Error getting processing results: {str(e)}")
+        logger.error("Error getting processing results: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 
@@ -249,19 +314,19 @@ async def get_processing_result(file_id: str):
         
         return result
     except Exception as e:
-        logger.error(f"Error getting processing result: {str(e)}")
+        logger.error("Error getting processing result: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.get("/logs", response_model=List[LogEntry])
-async def get_recent_logs(limit: int = 100):
+def get_recent_logs(limit: int = 100):
     """Get recent log entries"""
     try:
         # TODO: Implement log retrieval from log files
         # For now, return empty list
         return []
     except Exception as e:
-        logger.error(f"Error getting logs: {str(e)}")
+        logger.error("Error getting logs: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 
@@ -283,7 +348,7 @@ async def delete_processing_result(file_id: str):
         else:
             raise HTTPException(status_code=404, detail="Processing result not found")
     except Exception as e:
-        logger.error(f"Error deleting processing result: {str(e)}")
+        logger.error("Error deleting processing result: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 
@@ -1,10 +1,15 @@
 """
 Data models for the AI Invoice Processing Agent
 """
-from datetime import datetime
+from datetime import datetime, timezone
 from enum import Enum
 from typing import Optional, Dict, Any, List
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
+
+
+def utc_now() -> datetime:
+    """Get the current time as a timezone-aware UTC datetime"""
+    return datetime.now(timezone.utc)
 
 
 class ProcessingStatus(str, Enum):
@@ -27,6 +32,9 @@ class FileType(str, Enum):
 
 class InvoiceData(BaseModel):
     """Structured invoice data model"""
+    # Model output may carry extra keys; drop them
+    model_config = ConfigDict(extra="ignore")
+    
     invoice_number: Optional[str] = Field(None, description="Invoice number")
     date: Optional[str] = Field(None, description="Invoice date")
     due_date: Optional[str] = Field(None, description="Due date")
@@ -52,8 +60,8 @@ class ProcessingResult(BaseModel):
     invoice_data: Optional[InvoiceData] = Field(None, description="Extracted invoice data")
     error_message: Optional[str] = Field(None, description="Error message if failed")
     processing_time: Optional[float] = Field(None, description="Processing time in seconds")
-    created_at: datetime = Field(default_factory=datetime.utcnow, description="Creation timestamp")
-    updated_at: datetime = Field(default_factory=datetime.utcnow, description="Last update timestamp")
+    created_at: datetime = Field(default_factory=utc_now, description="Creation timestamp")
+    updated_at: datetime = Field(default_factory=utc_now, description="Last update timestamp")
 
 
 class SystemStats(BaseModel):
@@ -65,25 +73,33 @@ class SystemStats(BaseModel):
     processing: int = Field(0, description="Currently processing files")
     average_processing_time: float = Field(0.0, description="Average processing time")
     uptime: str = Field("", description="System uptime")
+    queue_size: int = Field(0, description="Files waiting in the processing queue")
+    dropped_files: int = Field(0, description="Files shed from a full processing queue")
 
 
 class APIResponse(BaseModel):
     """Standard API response model"""
+    model_config = ConfigDict(frozen=True)
+    
     success: bool = Field(..., description="Operation success status")
     message: str = Field(..., description="Response message")
     data: Optional[Dict[str, Any]] = Field(None, description="Response data")
-    timestamp: datetime = Field(default_factory=datetime.utcnow, description="Response timestamp")
+    timestamp: datetime = Field(default_factory=utc_now, description="Response timestamp")
 
 
 class ProcessingRequest(BaseModel):
     """Manual processing request model"""
+    model_config = ConfigDict(frozen=True)
+    
     file_path: Optional[str] = Field(None, description="Specific file path to process")
     force_reprocess: bool = Field(False, description="Force reprocessing of already processed files")
 
 
 class LogEntry(BaseModel):
     """Log entry model"""
-    timestamp: datetime = Field(default_factory=datetime.utcnow, description="Log timestamp")
+    model_config = ConfigDict(frozen=True)
+    
+    timestamp: datetime = Field(default_factory=utc_now, description="Log timestamp")
     level: str = Field(..., description="Log level")
     message: str = Field(..., description="Log message")
     module: str = Field(..., description="Module name")
@@ -92,8 +108,10 @@ class LogEntry(BaseModel):
 
 class HealthCheck(BaseModel):
     """Health check response model"""
+    model_config = ConfigDict(frozen=True)
+    
     status: str = Field("healthy", description="Service status")
     version: str = Field("1.0.0", description="Application version")
-    timestamp: datetime = Field(default_factory=datetime.utcnow, description="Check timestamp")
+    timestamp: datetime = Field(default_factory=utc_now, description="Check timestamp")
     services: Dict[str, str] = Field(default_factory=dict, description="Service statuses")
 
@@ -2,8 +2,9 @@
 File monitoring service for automatic invoice processing
 """
 import asyncio
+import os
 from pathlib import Path
-from typing import Optional
+from typing import Any, List, Optional, Set
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler, FileCreatedEvent, FileMovedEvent
 
@@ -13,57 +14,119 @@ from src.utils.logger import get_logger
 
 logger = get_logger(__name__)
 
+# How long to wait for more queued files before processing a partial batch
+BATCH_MAX_WAIT_SECONDS = 0.5
+
+# Upper bound on files waiting to be processed
+MAX_QUEUE_SIZE = 10_000
+
+# Polling used to wait for new files to be fully written: a file counts as
+# written once this many consecutive samples see the same size and mtime
+FILE_SETTLE_INTERVAL_SECONDS = 0.1
+FILE_SETTLE_SAMPLES = 5
+FILE_SETTLE_TIMEOUT_SECONDS = 30
+
+
+class NewestFirstQueue(asyncio.LifoQueue):
+    """LIFO queue that sheds its oldest entry instead of rejecting when full"""
+    
+    def put_shedding_oldest(self, item) -> Optional[Any]:
+        """Put an item without waiting, returning the oldest item if one was dropped"""
+        dropped = None
+        if self.full():
+            # The bottom of the stack is the oldest entry
+            dropped = self._queue.pop(0)
+            self.task_done()
+        self.put_nowait(item)
+        return dropped
+
 
 class InvoiceFileHandler(FileSystemEventHandler):
     """File system event handler for invoice files"""
     
-    def __init__(self, processor_service):
+    def __init__(self, processor_service, loop: Optional[asyncio.AbstractEventLoop] = None):
         super().__init__()
         self.processor_service = processor_service
-        self.processing_queue = asyncio.Queue()
+        # Newest files first, so fresh uploads are not starved by a backlog
+        self.processing_queue = NewestFirstQueue(maxsize=MAX_QUEUE_SIZE)
+        # Watchdog calls the handler from its own thread, so queue onto this loop
+        self.loop = loop
+        # Files queued but not yet processed, so repeated events queue once
+        self.queued_files: Set[Path] = set()
+        # Queued files closed after their write settle check may have started
+        self.rearmed_files: Set[Path] = set()
+        self.dropped_files = 0
     
     def on_created(self, event):
         """Handle file creation events"""
         if not event.is_directory:
             self._handle_new_file(event.src_path)
     
+    def on_closed(self, event):
+        """Handle file closed-after-write events (inotify only)"""
+        if not event.is_directory:
+            # The writer is done, so check the file again even if it is queued
+            self._handle_new_file(event.src_path, rearm=True)
+    
     def on_moved(self, event):
         """Handle file move events"""
         if not event.is_directory:
             self._handle_new_file(event.dest_path)
     
-    def _handle_new_file(self, file_path: str):
+    def _handle_new_file(self, file_path: str, rearm: bool = False):
         """Handle new file detection"""
         try:
             path = Path(file_path)
             
             # Check if file format is supported
-            if is_supported_format(path.name, settings.supported_formats_list):
-                logger.info(f"New invoice file detected: {path.name}")
+            if is_supported_format(path.name, settings.supported_formats_set):
+                logger.info("New invoice file detected: %s", path.name)
                 
                 # Add to processing queue
-                asyncio.create_task(self._queue_file_for_processing(path))
+                if self.loop is None:
+                    raise RuntimeError("No event loop to queue files on")
+                self.loop.call_soon_threadsafe(self.enqueue_file, path, rearm)
             else:
-                logger.warning(f"Unsupported file format detected: {path.name}")
+                logger.warning("Unsupported file format detected: %s", path.name)
         
-        except Exception as e:
-            logger.error(f"Error handling new file {file_path}: {str(e)}")
+        except Exception:
+            logger.exception("Error handling new file %s", file_path)
     
-    async def _queue_file_for_processing(self, file_path: Path):
-        """Queue file for processing"""
-        try:
-            # Wait a bit to ensure file is fully written
-            await asyncio.sleep(2)
-            
-            # Check if file still exists and is readable
-            if file_path.exists() and file_path.is_file():
-                await self.processing_queue.put(file_path)
-                logger.info(f"Queued file for processing: {file_path.name}")
-            else:
-                logger.warning(f"File no longer exists or not readable: {file_path}")
+    def enqueue_file(self, file_path: Path, rearm: bool = False):
+        """Queue file for processing without waiting (runs on the event loop)
+        
+        A file that is already queued is not queued twice; with rearm, it is
+        queued again once its current pass is done.
+        """
+        if file_path in self.queued_files:
+            if rearm:
+                self.rearmed_files.add(file_path)
+            return
+        
+        dropped = self.processing_queue.put_shedding_oldest(file_path)
+        self.queued_files.add(file_path)
+        logger.info("Queued file for processing: %s", file_path.name)
+        
+        if dropped is not None:
+            self.queued_files.discard(dropped)
+            self.rearmed_files.discard(dropped)
+            self.dropped_files += 1
+            logger.warning("Processing queue full, leaving %s for periodic processing", dropped.name)
+    
+    def mark_settling(self, file_paths: List[Path]):
+        """Note that dequeued files are about to be checked for a finished write"""
+        # That check starts after any close event seen so far
+        self.rearmed_files.difference_update(file_paths)
+    
+    def mark_processed(self, file_paths: List[Path]):
+        """Allow processed files to be queued again by later events"""
+        self.queued_files.difference_update(file_paths)
         
-        except Exception as e:
-            logger.error(f"Error queuing file {file_path}: {str(e)}")
+        # Files closed while being checked or processed get another pass
+        for file_path in file_paths:
+            if file_path in self.rearmed_files:
+                self.rearmed_files.discard(file_path)
+                self.enqueue_file(file_path)
 
 
 class FileMonitorService:
@@ -89,7 +152,7 @@ class FileMonitorService:
             settings.incoming_path.mkdir(parents=True, exist_ok=True)
             
             # Create file handler
-            self.file_handler = InvoiceFileHandler(self.processor_service)
+            self.file_handler = InvoiceFileHandler(self.processor_service, asyncio.get_running_loop())
             
             # Create and start observer
             self.observer = Observer()
@@ -100,20 +163,20 @@ class FileMonitorService:
             )
             self.observer.start()
             
-            # Start processing task
-            self.processing_task = asyncio.create_task(self._process_queue())
+            # Start processing workers
+            self.processing_task = asyncio.create_task(self._run_workers())
             
             # Start periodic processing task
             asyncio.create_task(self._periodic_processing())
             
             self.is_running = True
-            logger.info(f"File monitoring started for: {settings.incoming_path}")
+            logger.info("File monitoring started for: %s", settings.incoming_path)
             
             # Process any existing files
             await self._process_existing_files()
             
-        except Exception as e:
-            logger.error(f"Error starting file monitoring: {str(e)}")
+        except Exception:
+            logger.exception("Error starting file monitoring")
             await self.stop_monitoring()
             raise
     
@@ -144,8 +207,21 @@ class FileMonitorService:
             self.file_handler = None
             logger.info("File monitoring stopped")
             
-        except Exception as e:
-            logger.error(f"Error stopping file monitoring: {str(e)}")
+        except Exception:
+            logger.exception("Error stopping file monitoring")
+    
+    async def _run_workers(self):
+        """Run queue consumers concurrently; cancelling this cancels them all"""
+        workers = [
+            asyncio.create_task(self._process_queue())
+            for _ in range(max(1, settings.worker_concurrency))
+        ]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
     
     async def _process_queue(self):
         """Process files from the queue"""
@@ -158,20 +234,68 @@ class FileMonitorService:
                             self.file_handler.processing_queue.get(),
                             timeout=1.0
                         )
-                        
-                        # Process the file
-                        await self.processor_service.process_single_file(file_path)
-                        
                     except asyncio.TimeoutError:
                         # No file in queue, continue
                         continue
+                    
+                    # Process the file together with any that arrive shortly after
+                    batch = await self._collect_batch(file_path)
+                    self.file_handler.mark_settling(batch)
+                    try:
+                        ready = await asyncio.gather(*(self._wait_until_written(path) for path in batch))
+                        ready_files = [path for path, is_ready in zip(batch, ready) if is_ready]
+                        if ready_files:
+                            await self.processor_service.process_files_batch(ready_files)
+                    finally:
+                        if self.file_handler:
+                            self.file_handler.mark_processed(batch)
                 else:
                     await asyncio.sleep(1)
             
-            except Exception as e:
-                logger.error(f"Error in queue processing: {str(e)}")
+            except Exception:
+                logger.exception("Error in queue processing")
                 await asyncio.sleep(5)  # Wait before retrying
     
+    async def _collect_batch(self, first_file: Path) -> List[Path]:
+        """Gather queued files into a batch, waiting at most BATCH_MAX_WAIT_SECONDS"""
+        queue = self.file_handler.processing_queue
+        batch = [first_file]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + BATCH_MAX_WAIT_SECONDS
+        
+        while len(batch) < settings.batch_size:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+        
+        return batch
+    
+    async def _wait_until_written(self, file_path: Path) -> bool:
+        """Wait until a file's size and mtime stop changing; False if it disappears"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + FILE_SETTLE_TIMEOUT_SECONDS
+        last_state = None
+        stable_samples = 0
+        
+        while True:
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                logger.warning("File no longer exists or not readable: %s", file_path)
+                return False
+            
+            state = (stat.st_size, stat.st_mtime_ns)
+            stable_samples = stable_samples + 1 if state == last_state else 1
+            if stable_samples >= FILE_SETTLE_SAMPLES or loop.time() >= deadline:
+                return True
+            
+            last_state = state
+            await asyncio.sleep(FILE_SETTLE_INTERVAL_SECONDS)
+    
     async def _periodic_processing(self):
         """Periodic processing of incoming folder"""
         while self.is_running:
@@ -181,35 +305,43 @@ class FileMonitorService:
                 # Process any files that might have been missed
                 await self.processor_service.process_files()
                 
-            except Exception as e:
-                logger.error(f"Error in periodic processing: {str(e)}")
+            except Exception:
+                logger.exception("Error in periodic processing")
                 await asyncio.sleep(30)  # Wait longer on error
     
     async def _process_existing_files(self):
         """Process any existing files in the incoming folder"""
         try:
             incoming_path = settings.incoming_path
-            supported_formats = settings.supported_formats_list
+            matches_format = settings.supported_filename_pattern.fullmatch
             
-            existing_files = []
-            for file_path in incoming_path.iterdir():
-                if file_path.is_file() and is_supported_format(file_path.name, supported_formats):
-                    existing_files.append(file_path)
+            # One directory pass; the extension check is a single compiled-regex match
+            with os.scandir(incoming_path) as entries:
+                existing_files = [
+                    Path(entry.path) for entry in entries
+                    if matches_format(entry.name) and entry.is_file(follow_symlinks=False)
+                ]
             
             if existing_files:
-                logger.info(f"Found {len(existing_files)} existing files to process")
+                logger.info("Found %s existing files to process", len(existing_files))
                 
                 # Queue existing files for processing
                 if self.file_handler:
                     for file_path in existing_files:
-                        await self.file_handler.processing_queue.put(file_path)
+                        self.file_handler.enqueue_file(file_path)
             
-        except Exception as e:
-            logger.error(f"Error processing existing files: {str(e)}")
+        except Exception:
+            logger.exception("Error processing existing files")
     
     def get_queue_size(self) -> int:
         """Get current queue size"""
         if self.file_handler:
             return self.file_handler.processing_queue.qsize()
         return 0
+    
+    def get_dropped_count(self) -> int:
+        """Get number of files shed from a full queue"""
+        if self.file_handler:
+            return self.file_handler.dropped_files
+        return 0
 
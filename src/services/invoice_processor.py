@@ -2,40 +2,128 @@
 Invoice processing service using LangChain and AI models
 """
 import asyncio
+import heapq
 import json
+import os
 import re
+import shutil
 import time
-from datetime import datetime
+from collections import OrderedDict
+from datetime import datetime, timezone
 from pathlib import Path
 from typing import Optional, List, Dict, Any
 
-from langchain_core.messages import HumanMessage
+from langchain_core.messages import HumanMessage, SystemMessage
 from langchain_ollama import ChatOllama
 from PIL import Image
 import base64
 import io
 
-from config.settings import settings
+try:
+    # SIMD base64 encoder; the stdlib one is several times slower on image-sized buffers
+    from pybase64 import b64encode_as_string
+except ImportError:
+    def b64encode_as_string(data) -> str:
+        """Encode bytes-like data to a base64 str"""
+        return base64.b64encode(data).decode()
+
+from config.settings import settings, ensure_directories
 from src.models import (
     InvoiceData, ProcessingResult, ProcessingStatus, 
     SystemStats
 )
 from src.utils.helpers import (
     generate_file_id, create_timestamped_filename,
-    ensure_unique_filename, get_file_size_mb
+    create_unique_file, ensure_unique_filename, get_file_size_mb, hash_file_content,
+    AsyncTTLCache
 )
 from src.utils.logger import get_logger
 
 logger = get_logger(__name__)
 
+# How long computed statistics are reused across requests
+STATS_CACHE_TTL_SECONDS = 0.5
+
+# JSON extraction from model responses
+_JSON_DECODER = json.JSONDecoder()
+_JSON_BLOCK_RE = re.compile(r'```json\s*\n(.*?)\n```', re.DOTALL)
+# Braces and whole string literals, so braces inside strings are skipped
+_JSON_TOKEN_RE = re.compile(r'"(?:[^"\\]|\\.)*+"|[{}]', re.DOTALL)
+
+# Fallback field extraction from free-text responses, tried in order
+_INVOICE_PATTERNS = tuple(re.compile(p, re.IGNORECASE) for p in (
+    r'Invoice Number[:\s]*([^\n\r]+)',
+    r'Invoice[:\s]*#?([0-9A-Za-z\-]+)',
+    r'Invoice ID[:\s]*([^\n\r]+)'
+))
+_DATE_PATTERNS = tuple(re.compile(p, re.IGNORECASE) for p in (
+    r'Invoice Date[:\s]*([^\n\r]+)',
+    r'Date[:\s]*([0-9]{1,2}[-/][0-9]{1,2}[-/][0-9]{2,4})',
+    r'Date[:\s]*([0-9]{1,2}-[A-Za-z]{3}-[0-9]{2,4})'
+))
+_VENDOR_PATTERNS = tuple(re.compile(p, re.IGNORECASE) for p in (
+    r'Vendor Name[:\s]*([^\n\r]+)',
+    r'Company[:\s]*([^\n\r]+)',
+    r'From[:\s]*([^\n\r]+)'
+))
+_TOTAL_PATTERNS = tuple(re.compile(p, re.IGNORECASE) for p in (
+    r'Total Amount[:\s]*([0-9,]+\.?[0-9]*)',
+    r'Total[:\s]*([0-9,]+\.?[0-9]*)',
+    r'Amount[:\s]*([0-9,]+\.?[0-9]*)'
+))
+_CURRENCY_RE = re.compile(r'Currency[:\s]*([A-Z]{3})', re.IGNORECASE)
+
+
+def _decode_first_json_object(text: str) -> Optional[Dict[str, Any]]:
+    """Decode the JSON object starting at the first '{', or None if it is not valid JSON"""
+    start = text.find('{')
+    if start < 0:
+        return None
+    try:
+        data, _ = _JSON_DECODER.raw_decode(text, start)
+    except json.JSONDecodeError:
+        return None
+    return data
+
+
+def _find_json_object(text: str) -> Optional[str]:
+    """Find the first brace-balanced JSON object in text in a single linear scan"""
+    start = text.find('{')
+    if start < 0:
+        return None
+    
+    depth = 0
+    for match in _JSON_TOKEN_RE.finditer(text, start):
+        token = match.group()
+        if token == '{':
+            depth += 1
+        elif token == '}':
+            depth -= 1
+            if depth == 0:
+                return text[start:match.end()]
+    return None
+
 
 class InvoiceProcessorService:
     """Service for processing invoice images and extracting data"""
     
     def __init__(self):
-        self.processing_results: Dict[str, ProcessingResult] = {}
+        # Insertion-ordered so the oldest results are evicted first once the cap is reached
+        self.processing_results: OrderedDict[str, ProcessingResult] = OrderedDict()
+        # Extracted data keyed by file content hash, so re-uploaded invoices skip the model
+        self._content_cache: OrderedDict[str, InvoiceData] = OrderedDict()
         self.stats = SystemStats()
         self.is_processing = False
+        # Dashboards poll stats from several tabs; coalesce those into one computation
+        self._stats_cache = AsyncTTLCache(self._compute_statistics, STATS_CACHE_TTL_SECONDS)
+        # Bounds model calls across batches and queue workers instead of pausing between batches
+        self._llm_semaphore = asyncio.Semaphore(max(1, settings.max_concurrent_llm_calls))
+        # Bounds files in flight (marked PROCESSING, hashing, waiting for the model) to one batch
+        self._file_semaphore = asyncio.Semaphore(max(1, settings.batch_size))
+        # Byte-identical across calls so the model server can reuse the cached prompt prefix
+        self._extraction_prompt = SystemMessage(content=self._create_invoice_extraction_prompt())
+        
+        ensure_directories()
         
         # Initialize AI model
         try:
@@ -54,19 +142,30 @@ class InvoiceProcessorService:
         """Encode image to base64 string"""
         try:
             with Image.open(image_path) as img:
+                max_size = 1024
+                
+                # Small RGB JPEGs are sent as-is, skipping a decode and re-encode
+                if img.format == 'JPEG' and img.mode == 'RGB' and img.width <= max_size and img.height <= max_size:
+                    return b64encode_as_string(image_path.read_bytes())
+                
+                # Let the JPEG decoder downscale and convert while decoding (no-op for other formats)
+                img.draft('RGB', (max_size, max_size))
+                
                 # Convert to RGB if necessary
                 if img.mode != 'RGB':
                     img = img.convert('RGB')
                 
                 # Resize if too large (max 1024x1024 for better processing)
-                max_size = 1024
                 if img.width > max_size or img.height > max_size:
-                    img.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+                    # thumbnail() box-reduces large ratios first, after which bilinear is enough
+                    ratio = max(img.width, img.height) / max_size
+                    resample = Image.Resampling.BILINEAR if ratio > 2 else Image.Resampling.LANCZOS
+                    img.thumbnail((max_size, max_size), resample)
                 
-                # Convert to base64
+                # Convert to base64 straight from the buffer, without copying it out
                 buffer = io.BytesIO()
                 img.save(buffer, format='JPEG', quality=85)
-                img_str = base64.b64encode(buffer.getvalue()).decode()
+                img_str = b64encode_as_string(buffer.getbuffer())
                 return img_str
         except Exception as e:
             logger.error(f"Error encoding image {image_path}: {str(e)}")
@@ -137,24 +236,26 @@ Example response:
         try:
             logger.info(f"Processing invoice image: {image_path}")
             
-            # Encode image to base64
-            image_base64 = self._encode_image_to_base64(image_path)
+            # Encode image to base64 in a worker thread so concurrent files decode in parallel
+            image_base64 = await asyncio.to_thread(self._encode_image_to_base64, image_path)
             
-            # Create message with image
-            message = HumanMessage(
-                content=[
-                    {"type": "text", "text": self._create_invoice_extraction_prompt()},
-                    {
-                        "type": "image_url",
-                        "image_url": {"url": f"data:image/jpeg;base64,{image_base64}"}
-                    }
-                ]
-            )
+            # Static instructions first, then the image; anything per-file must go after the prompt
+            messages = [
+                self._extraction_prompt,
+                HumanMessage(
+                    content=[
+                        {
+                            "type": "image_url",
+                            "image_url": {"url": f"data:image/jpeg;base64,{image_base64}"}
+                        }
+                    ]
+                )
+            ]
             
-            # Process with AI model with timeout
+            # Process with AI model with timeout, using the client's native async API
             try:
                 response = await asyncio.wait_for(
-                    asyncio.to_thread(self.llm.invoke, [message]),
+                    self.llm.ainvoke(messages),
                     timeout=settings.ai_processing_timeout_seconds
                 )
             except asyncio.TimeoutError:
@@ -165,29 +266,32 @@ Example response:
                 response_content = response.content
                 logger.info(f"Raw AI response length: {len(response_content)} characters")
                 
-                # Try to extract JSON from markdown code blocks first
-                json_match = re.search(r'```json\s*\n(.*?)\n```', response_content, re.DOTALL)
-                if json_match:
-                    json_str = json_match.group(1).strip()
-                    logger.info("Found JSON in markdown code block")
-                else:
-                    # Try to find JSON object directly
-                    json_match = re.search(r'\{[^{}]*(?:\{[^{}]*\}[^{}]*)*\}', response_content, re.DOTALL)
+                # Decode the first JSON object in place; this also covers ```json fenced blocks
+                invoice_data_dict = _decode_first_json_object(response_content)
+                if invoice_data_dict is None:
+                    # Try to extract JSON from markdown code blocks first
+                    json_match = _JSON_BLOCK_RE.search(response_content)
                     if json_match:
-                        json_str = json_match.group(0).strip()
-                        logger.info("Found JSON object in response")
+                        json_str = json_match.group(1).strip()
+                        logger.info("Found JSON in markdown code block")
                     else:
-                        # Try to extract from the structured response
-                        logger.warning("No JSON block found, attempting fallback extraction")
-                        fallback_data = self._extract_fallback_data(response_content)
-                        if fallback_data:
-                            logger.info("Using fallback data extraction")
-                            return InvoiceData(**fallback_data)
+                        # Try to find JSON object directly
+                        json_object = _find_json_object(response_content)
+                        if json_object:
+                            json_str = json_object
+                            logger.info("Found JSON object in response")
                         else:
-                            raise Exception("No valid JSON found in AI response")
-                
-                # Parse the extracted JSON
-                invoice_data_dict = json.loads(json_str)
+                            # Try to extract from the structured response
+                            logger.warning("No JSON block found, attempting fallback extraction")
+                            fallback_data = self._extract_fallback_data(response_content)
+                            if fallback_data:
+                                logger.info("Using fallback data extraction")
+                                return InvoiceData(**fallback_data)
+                            else:
+                                raise Exception("No valid JSON found in AI response")
+                    
+                    # Parse the extracted JSON
+                    invoice_data_dict = json.loads(json_str)
                 invoice_data = InvoiceData(**invoice_data_dict)
                 logger.info(f"Successfully extracted invoice data from {image_path}")
                 return invoice_data
@@ -216,49 +320,29 @@ Example response:
         data = {}
         
         # Extract invoice number
-        invoice_patterns = [
-            r'Invoice Number[:\s]*([^\n\r]+)',
-            r'Invoice[:\s]*#?([0-9A-Za-z\-]+)',
-            r'Invoice ID[:\s]*([^\n\r]+)'
-        ]
-        for pattern in invoice_patterns:
-            match = re.search(pattern, response_content, re.IGNORECASE)
+        for pattern in _INVOICE_PATTERNS:
+            match = pattern.search(response_content)
             if match:
                 data['invoice_number'] = match.group(1).strip()
                 break
         
         # Extract date
-        date_patterns = [
-            r'Invoice Date[:\s]*([^\n\r]+)',
-            r'Date[:\s]*([0-9]{1,2}[-/][0-9]{1,2}[-/][0-9]{2,4})',
-            r'Date[:\s]*([0-9]{1,2}-[A-Za-z]{3}-[0-9]{2,4})'
-        ]
-        for pattern in date_patterns:
-            match = re.search(pattern, response_content, re.IGNORECASE)
+        for pattern in _DATE_PATTERNS:
+            match = pattern.search(response_content)
             if match:
                 data['date'] = match.group(1).strip()
                 break
         
         # Extract vendor name
-        vendor_patterns = [
-            r'Vendor Name[:\s]*([^\n\r]+)',
-            r'Company[:\s]*([^\n\r]+)',
-            r'From[:\s]*([^\n\r]+)'
-        ]
-        for pattern in vendor_patterns:
-            match = re.search(pattern, response_content, re.IGNORECASE)
+        for pattern in _VENDOR_PATTERNS:
+            match = pattern.search(response_content)
             if match:
                 data['vendor_name'] = match.group(1).strip()
                 break
         
         # Extract total amount
-        total_patterns = [
-            r'Total Amount[:\s]*([0-9,]+\.?[0-9]*)',
-            r'Total[:\s]*([0-9,]+\.?[0-9]*)',
-            r'Amount[:\s]*([0-9,]+\.?[0-9]*)'
-        ]
-        for pattern in total_patterns:
-            match = re.search(pattern, response_content, re.IGNORECASE)
+        for pattern in _TOTAL_PATTERNS:
+            match = pattern.search(response_content)
             if match:
                 amount_str = match.group(1).replace(',', '')
                 try:
@@ -268,7 +352,7 @@ Example response:
                     continue
         
         # Extract currency
-        currency_match = re.search(r'Currency[:\s]*([A-Z]{3})', response_content, re.IGNORECASE)
+        currency_match = _CURRENCY_RE.search(response_content)
         if currency_match:
             data['currency'] = currency_match.group(1).upper()
         
@@ -282,8 +366,63 @@ Example response:
         
         return data if any(v != 'UNKNOWN' and v != 0.0 for v in data.values()) else None
     
+    def _store_result(self, result: ProcessingResult):
+        """Store a result as the newest entry, evicting the oldest beyond max_results_cache"""
+        self.processing_results[result.file_id] = result
+        self.processing_results.move_to_end(result.file_id)
+        while len(self.processing_results) > settings.max_results_cache:
+            self.processing_results.popitem(last=False)
+    
+    def _get_cached_content(self, content_hash: str, file_path: Path) -> Optional[InvoiceData]:
+        """Get extracted data for a content hash, marking it recently used"""
+        invoice_data = self._content_cache.get(content_hash)
+        if invoice_data is not None:
+            self._content_cache.move_to_end(content_hash)
+            logger.info(f"Reusing extracted data for identical content: {file_path.name}")
+        return invoice_data
+    
+    def _cache_content(self, content_hash: str, invoice_data: InvoiceData):
+        """Remember extracted data for a content hash, evicting the oldest beyond max_results_cache"""
+        self._content_cache[content_hash] = invoice_data
+        self._content_cache.move_to_end(content_hash)
+        while len(self._content_cache) > settings.max_results_cache:
+            self._content_cache.popitem(last=False)
+    
+    def _save_outputs(self, file_path: Path, invoice_data: InvoiceData) -> Path:
+        """Save extracted data as JSON and move the image to the generated folder"""
+        # Create output filename
+        timestamp_suffix = datetime.now(timezone.utc).strftime("%Y%m%d_%H%M%S")
+        json_filename = f"{file_path.stem}_{timestamp_suffix}.json"
+        
+        # Claim a unique filename and save JSON output straight from the model,
+        # without building an intermediate dict
+        json_path, json_file = create_unique_file(settings.generated_path / json_filename)
+        try:
+            with json_file:
+                json_file.write(invoice_data.model_dump_json(indent=2).encode('utf-8'))
+        except BaseException:
+            # Don't leave a truncated output behind
+            json_path.unlink(missing_ok=True)
+            raise
+        
+        # Move original file to generated folder
+        moved_image_filename = create_timestamped_filename(file_path.name, timestamp_suffix)
+        moved_image_path = settings.generated_path / moved_image_filename
+        moved_image_path = ensure_unique_filename(moved_image_path)
+        
+        # Move file to generated folder (a rename on the same filesystem)
+        shutil.move(file_path, moved_image_path)
+        
+        return json_path
+    
     async def process_single_file(self, file_path: Path, force_reprocess: bool = False) -> ProcessingResult:
         """Process a single file with timeout protection"""
+        # Files beyond the limit wait here, still pending in the incoming folder
+        async with self._file_semaphore:
+            return await self._process_file(file_path, force_reprocess)
+    
+    async def _process_file(self, file_path: Path, force_reprocess: bool) -> ProcessingResult:
+        """Process a single file (called with a file slot held)"""
         file_id = generate_file_id(file_path.name)
         
         # Check if already processed
@@ -301,7 +440,7 @@ Example response:
             status=ProcessingStatus.PROCESSING
         )
         
-        self.processing_results[file_id] = result
+        self._store_result(result)
         start_time = time.time()
         
         try:
@@ -310,38 +449,31 @@ Example response:
             if file_size_mb > settings.max_file_size_mb:
                 raise Exception(f"File size ({file_size_mb:.2f}MB) exceeds maximum allowed size ({settings.max_file_size_mb}MB)")
             
-            # Process invoice with overall timeout
-            try:
-                invoice_data = await asyncio.wait_for(
-                    self.process_invoice_image(file_path),
-                    timeout=settings.file_processing_timeout_seconds
-                )
-            except asyncio.TimeoutError:
-                raise Exception(f"File processing timeout after {settings.file_processing_timeout_seconds} seconds")
-            
-            # Create output filename
-            timestamp_suffix = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
-            json_filename = f"{file_path.stem}_{timestamp_suffix}.json"
-            json_path = settings.generated_path / json_filename
-            
-            # Ensure unique filename
-            json_path = ensure_unique_filename(json_path)
+            # Identical content uploaded under another name reuses the earlier extraction
+            content_hash = await asyncio.to_thread(hash_file_content, file_path)
             
-            # Save JSON output
-            with open(json_path, 'w', encoding='utf-8') as f:
-                json.dump(invoice_data.dict(), f, indent=2, ensure_ascii=False, default=str)
+            # Cache hits don't need a model slot
+            invoice_data = None if force_reprocess else self._get_cached_content(content_hash, file_path)
             
-            # Move original file to generated folder
-            moved_image_filename = create_timestamped_filename(file_path.name, timestamp_suffix)
-            moved_image_path = settings.generated_path / moved_image_filename
-            moved_image_path = ensure_unique_filename(moved_image_path)
-            
-            # Copy file to generated folder
-            import shutil
-            shutil.copy2(file_path, moved_image_path)
+            if invoice_data is None:
+                # Waiting for a slot does not count towards the processing timeout
+                async with self._llm_semaphore:
+                    # An identical file may have been extracted while this one waited
+                    invoice_data = None if force_reprocess else self._get_cached_content(content_hash, file_path)
+                    
+                    if invoice_data is None:
+                        # Process invoice with overall timeout
+                        try:
+                            invoice_data = await asyncio.wait_for(
+                                self.process_invoice_image(file_path),
+                                timeout=settings.file_processing_timeout_seconds
+                            )
+                        except asyncio.TimeoutError:
+                            raise Exception(f"File processing timeout after {settings.file_processing_timeout_seconds} seconds")
+                        self._cache_content(content_hash, invoice_data)
             
-            # Remove from incoming folder
-            file_path.unlink()
+            # Write the JSON output and move the image without blocking the event loop
+            json_path = await asyncio.to_thread(self._save_outputs, file_path, invoice_data)
             
             # Update result
             processing_time = time.time() - start_time
@@ -349,7 +481,7 @@ Example response:
             result.processed_filename = json_path.name
             result.invoice_data = invoice_data
             result.processing_time = processing_time
-            result.updated_at = datetime.utcnow()
+            result.updated_at = datetime.now(timezone.utc)
             
             # Update stats
             self.stats.total_processed += 1
@@ -363,7 +495,7 @@ Example response:
             result.status = ProcessingStatus.FAILED
             result.error_message = str(e)
             result.processing_time = processing_time
-            result.updated_at = datetime.utcnow()
+            result.updated_at = datetime.now(timezone.utc)
             
             # Update stats
             self.stats.total_processed += 1
@@ -373,6 +505,19 @@ Example response:
         
         return result
     
+    async def process_files_batch(self, file_paths: List[Path], force_reprocess: bool = False) -> List[ProcessingResult]:
+        """Process a batch of files concurrently, returning one result per file"""
+        results = await asyncio.gather(
+            *(self.process_single_file(file_path, force_reprocess) for file_path in file_paths),
+            return_exceptions=True
+        )
+        
+        for file_path, result in zip(file_paths, results):
+            if isinstance(result, Exception):
+                logger.error(f"Unexpected error processing {file_path.name}: {str(result)}")
+        
+        return [result for result in results if isinstance(result, ProcessingResult)]
+    
     async def process_files(self, specific_file: Optional[str] = None, force_reprocess: bool = False):
         """Process files in the incoming folder"""
         if self.is_processing and not specific_file:
@@ -396,54 +541,60 @@ Example response:
                     logger.error(f"File not found: {specific_file}")
             else:
                 # Process all files in incoming folder
-                supported_formats = settings.supported_formats_list
-                
-                files_to_process = []
-                for file_path in incoming_path.iterdir():
-                    if file_path.is_file():
-                        file_extension = file_path.suffix.lower().lstrip('.')
-                        if file_extension in supported_formats:
-                            files_to_process.append(file_path)
+                files_to_process = await asyncio.to_thread(self._list_incoming_files)
                 
                 if files_to_process:
                     logger.info(f"Found {len(files_to_process)} files to process")
                     
-                    # Process files in batches
-                    batch_size = settings.batch_size
-                    for i in range(0, len(files_to_process), batch_size):
-                        batch = files_to_process[i:i + batch_size]
-                        
-                        # Process batch concurrently
-                        tasks = [self.process_single_file(file_path, force_reprocess) for file_path in batch]
-                        await asyncio.gather(*tasks, return_exceptions=True)
-                        
-                        # Small delay between batches
-                        if i + batch_size < len(files_to_process):
-                            await asyncio.sleep(1)
+                    # Schedule everything at once; the file and model semaphores limit how many run
+                    await self.process_files_batch(files_to_process, force_reprocess)
                 else:
                     logger.debug("No files to process in incoming folder")
         
         finally:
             self.is_processing = False
     
+    def _list_incoming_files(self) -> List[Path]:
+        """List supported files in the incoming folder with a single scandir pass"""
+        matches_format = settings.supported_filename_pattern.fullmatch
+        with os.scandir(settings.incoming_path) as entries:
+            return [
+                Path(entry.path) for entry in entries
+                if matches_format(entry.name) and entry.is_file(follow_symlinks=False)
+            ]
+    
+    def _count_pending_files(self) -> int:
+        """Count supported files waiting in the incoming folder"""
+        matches_format = settings.supported_filename_pattern.fullmatch
+        with os.scandir(settings.incoming_path) as entries:
+            return sum(
+                1 for entry in entries
+                if matches_format(entry.name) and entry.is_file(follow_symlinks=False)
+            )
+    
     async def get_statistics(self) -> SystemStats:
-        """Get processing statistics"""
+        """Get processing statistics (cached for STATS_CACHE_TTL_SECONDS)"""
+        return await self._stats_cache.get()
+    
+    async def _compute_statistics(self) -> SystemStats:
+        """Compute processing statistics"""
         # Count current processing status
         processing_count = sum(1 for result in self.processing_results.values() 
                              if result.status == ProcessingStatus.PROCESSING)
         
         self.stats.processing = processing_count
-        self.stats.pending = len([f for f in settings.incoming_path.iterdir() 
-                                if f.is_file() and f.suffix.lower().lstrip('.') in settings.supported_formats_list])
+        self.stats.pending = await asyncio.to_thread(self._count_pending_files)
         
         return self.stats
     
     async def get_recent_results(self, limit: int = 50) -> List[ProcessingResult]:
         """Get recent processing results"""
-        results = list(self.processing_results.values())
-        # Sort by updated_at descending
-        results.sort(key=lambda x: x.updated_at or datetime.min, reverse=True)
-        return results[:limit]
+        # Select the newest by updated_at without sorting every result
+        return heapq.nlargest(
+            limit,
+            self.processing_results.values(),
+            key=lambda x: x.updated_at
+        )
     
     async def delete_result(self, file_id: str) -> bool:
         """Delete a processing result"""
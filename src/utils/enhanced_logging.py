@@ -1,16 +1,48 @@
 """
 Enhanced logging system with structured logging and error tracking
 """
+import atexit
+import heapq
 import logging
 import logging.handlers
 import json
+import threading
+import time
 import traceback
-from datetime import datetime
 from pathlib import Path
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, Tuple
 from contextlib import contextmanager
 
+import orjson
+
 from config.settings import settings
+from src.utils.logger import BatchedRotatingFileHandler, is_processing_logger, start_queue_listener
+
+# Tracked errors are written to disk at most this often
+ERROR_SAVE_INTERVAL_SECONDS = 5.0
+
+# Distinct messages counted per error type; the least common half is dropped beyond this
+MAX_COMMON_MESSAGES = 512
+
+# Extra record attributes included in structured log entries, in output order
+STRUCTURED_EXTRA_FIELDS = ('file_id', 'processing_time', 'error_type', 'user_id')
+
+# Last formatted second and its ISO 8601 text, replaced as a whole so threads never see a mix
+_timestamp_second: Tuple[int, str] = (-1, '')
+
+
+def format_utc_timestamp(seconds: float) -> str:
+    """Format a time.time() value as an ISO 8601 UTC timestamp with microseconds
+    
+    The date and time up to the second is formatted once per second and reused.
+    """
+    global _timestamp_second
+    second = int(seconds)
+    cached_second, prefix = _timestamp_second
+    if second != cached_second:
+        prefix = time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(second))
+        _timestamp_second = (second, prefix)
+    return f"{prefix}.{int((seconds - second) * 1_000_000):06d}"
 
 
 class StructuredFormatter(logging.Formatter):
@@ -18,7 +50,8 @@ class StructuredFormatter(logging.Formatter):
     
     def format(self, record):
         log_entry = {
-            'timestamp': datetime.utcnow().isoformat() + 'Z',
+            # When the record was created; formatting happens later on the listener thread
+            'timestamp': format_utc_timestamp(record.created) + 'Z',
             'level': record.levelname,
             'logger': record.name,
             'message': record.getMessage(),
@@ -29,18 +62,11 @@ class StructuredFormatter(logging.Formatter):
             'process': record.process
         }
         
-        # Add extra fields if present
-        if hasattr(record, 'file_id'):
-            log_entry['file_id'] = record.file_id
-        
-        if hasattr(record, 'processing_time'):
-            log_entry['processing_time'] = record.processing_time
-        
-        if hasattr(record, 'error_type'):
-            log_entry['error_type'] = record.error_type
-        
-        if hasattr(record, 'user_id'):
-            log_entry['user_id'] = record.user_id
+        # Add extra fields if present; extras live in the record's __dict__
+        record_fields = record.__dict__
+        for name in STRUCTURED_EXTRA_FIELDS:
+            if name in record_fields:
+                log_entry[name] = record_fields[name]
         
         # Add exception info if present
         if record.exc_info:
@@ -50,7 +76,8 @@ class StructuredFormatter(logging.Formatter):
                 'traceback': traceback.format_exception(*record.exc_info)
             }
         
-        return json.dumps(log_entry, ensure_ascii=False)
+        # orjson writes non-ASCII text as-is, like ensure_ascii=False
+        return orjson.dumps(log_entry, default=str).decode()
 
 
 class ProcessingLogger:
@@ -64,7 +91,7 @@ class ProcessingLogger:
         """Setup specialized handlers for processing logs"""
         # Processing-specific file handler
         processing_log_file = settings.log_path / "processing_detailed.log"
-        processing_handler = logging.handlers.RotatingFileHandler(
+        processing_handler = BatchedRotatingFileHandler(
             processing_log_file,
             maxBytes=settings.log_max_size_mb * 1024 * 1024,
             backupCount=settings.log_backup_count,
@@ -74,15 +101,16 @@ class ProcessingLogger:
         processing_handler.setLevel(logging.DEBUG)
         
         # Add filter to only capture processing-related logs
-        processing_handler.addFilter(lambda record: 'processing' in record.name.lower())
+        processing_handler.addFilter(lambda record: is_processing_logger(record.name))
         
         # Add handler if not already present
-        if not any(isinstance(h, logging.handlers.RotatingFileHandler) and 
-                  'processing_detailed' in str(h.baseFilename) for h in self.logger.handlers):
-            self.logger.addHandler(processing_handler)
+        if not any(isinstance(h, logging.handlers.QueueHandler) for h in self.logger.handlers):
+            start_queue_listener(self.logger, processing_handler)
     
     def log_file_start(self, file_id: str, filename: str, file_size: float):
         """Log start of file processing"""
+        if not self.logger.isEnabledFor(logging.INFO):
+            return
         self.logger.info(
             f"Started processing file: {filename}",
             extra={
@@ -95,6 +123,8 @@ class ProcessingLogger:
     
     def log_file_success(self, file_id: str, filename: str, processing_time: float, output_file: str):
         """Log successful file processing"""
+        if not self.logger.isEnabledFor(logging.INFO):
+            return
         self.logger.info(
             f"Successfully processed file: {filename}",
             extra={
@@ -108,6 +138,9 @@ class ProcessingLogger:
     
     def log_file_error(self, file_id: str, filename: str, error: Exception, processing_time: float):
         """Log file processing error"""
+        # Skip building extras and formatting the traceback when nothing would log it
+        if not self.logger.isEnabledFor(logging.ERROR):
+            return
         self.logger.error(
             f"Failed to process file: {filename} - {str(error)}",
             extra={
@@ -122,6 +155,8 @@ class ProcessingLogger:
     
     def log_ai_model_error(self, file_id: str, model_name: str, error: Exception):
         """Log AI model specific errors"""
+        if not self.logger.isEnabledFor(logging.ERROR):
+            return
         self.logger.error(
             f"AI model error for file {file_id}: {str(error)}",
             extra={
@@ -135,6 +170,8 @@ class ProcessingLogger:
     
     def log_file_monitoring_event(self, event_type: str, file_path: str):
         """Log file monitoring events"""
+        if not self.logger.isEnabledFor(logging.DEBUG):
+            return
         self.logger.debug(
             f"File monitoring event: {event_type} - {file_path}",
             extra={
@@ -150,6 +187,9 @@ class ErrorTracker:
     def __init__(self):
         self.error_log_file = settings.log_path / "error_tracking.json"
         self.errors: Dict[str, Any] = self._load_errors()
+        self._lock = threading.Lock()
+        self._save_timer: Optional[threading.Timer] = None
+        atexit.register(self.flush)
     
     def _load_errors(self) -> Dict[str, Any]:
         """Load existing error data"""
@@ -168,16 +208,41 @@ class ErrorTracker:
     def _save_errors(self):
         """Save error data to file"""
         try:
-            with open(self.error_log_file, 'w', encoding='utf-8') as f:
-                json.dump(self.errors, f, indent=2, ensure_ascii=False, default=str)
+            self.error_log_file.write_bytes(
+                orjson.dumps(self.errors, option=orjson.OPT_INDENT_2, default=str)
+            )
         except Exception as e:
             logging.getLogger(__name__).error(f"Failed to save error tracking data: {str(e)}")
     
+    def _schedule_save(self):
+        """Save after ERROR_SAVE_INTERVAL_SECONDS, coalescing errors tracked meanwhile"""
+        if self._save_timer is None:
+            self._save_timer = threading.Timer(ERROR_SAVE_INTERVAL_SECONDS, self.flush)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+    
+    def flush(self):
+        """Save pending error data to file now"""
+        with self._lock:
+            if self._save_timer is None:
+                return
+            self._save_timer.cancel()
+            self._save_timer = None
+            self._save_errors()
+    
     def track_error(self, error_type: str, error_message: str, file_id: Optional[str] = None, 
                    context: Optional[Dict[str, Any]] = None):
         """Track an error occurrence"""
-        timestamp = datetime.utcnow().isoformat()
+        timestamp = format_utc_timestamp(time.time())
         
+        with self._lock:
+            self._record_error(timestamp, error_type, error_message, file_id, context)
+            # The whole file is rewritten on save, so batch saves instead of saving per error
+            self._schedule_save()
+    
+    def _record_error(self, timestamp: str, error_type: str, error_message: str,
+                      file_id: Optional[str], context: Optional[Dict[str, Any]]):
+        """Add an error occurrence to the in-memory data"""
         # Update error counts
         if error_type not in self.errors['error_counts']:
             self.errors['error_counts'][error_type] = 0
@@ -198,9 +263,6 @@ class ErrorTracker:
         
         # Analyze error patterns
         self._analyze_error_patterns(error_type, error_message)
-        
-        # Save to file
-        self._save_errors()
     
     def _analyze_error_patterns(self, error_type: str, error_message: str):
         """Analyze error patterns for insights"""
@@ -215,9 +277,14 @@ class ErrorTracker:
         pattern['frequency'] += 1
         
         # Track common error messages
-        if error_message not in pattern['common_messages']:
-            pattern['common_messages'][error_message] = 0
-        pattern['common_messages'][error_message] += 1
+        common_messages = pattern['common_messages']
+        common_messages[error_message] = common_messages.get(error_message, 0) + 1
+        
+        # Unique messages would otherwise grow the dict (and every save) without limit
+        if len(common_messages) > MAX_COMMON_MESSAGES:
+            pattern['common_messages'] = dict(
+                heapq.nlargest(MAX_COMMON_MESSAGES // 2, common_messages.items(), key=lambda item: item[1])
+            )
     
     def get_error_summary(self) -> Dict[str, Any]:
         """Get error summary for reporting"""
@@ -244,7 +311,7 @@ class PerformanceLogger:
     
     def _setup_performance_handler(self):
         """Setup performance logging handler"""
-        perf_handler = logging.handlers.RotatingFileHandler(
+        perf_handler = BatchedRotatingFileHandler(
             settings.log_path / "performance.log",
             maxBytes=settings.log_max_size_mb * 1024 * 1024,
             backupCount=settings.log_backup_count,
@@ -253,40 +320,38 @@ class PerformanceLogger:
         perf_handler.setFormatter(StructuredFormatter())
         perf_handler.setLevel(logging.INFO)
         
-        if not any(isinstance(h, logging.handlers.RotatingFileHandler) and 
-                  'performance' in str(h.baseFilename) for h in self.logger.handlers):
-            self.logger.addHandler(perf_handler)
+        if not any(isinstance(h, logging.handlers.QueueHandler) for h in self.logger.handlers):
+            start_queue_listener(self.logger, perf_handler)
     
     @contextmanager
     def measure_time(self, operation: str, **context):
         """Context manager to measure operation time"""
-        start_time = datetime.utcnow()
+        start_time = time.time()
+        start_counter = time.perf_counter()
         try:
             yield
-            end_time = datetime.utcnow()
-            duration = (end_time - start_time).total_seconds()
+            duration = time.perf_counter() - start_counter
             
             self.logger.info(
                 f"Operation completed: {operation}",
                 extra={
                     'operation': operation,
                     'duration_seconds': duration,
-                    'start_time': start_time.isoformat(),
-                    'end_time': end_time.isoformat(),
+                    'start_time': format_utc_timestamp(start_time),
+                    'end_time': format_utc_timestamp(start_time + duration),
                     **context
                 }
             )
         except Exception as e:
-            end_time = datetime.utcnow()
-            duration = (end_time - start_time).total_seconds()
+            duration = time.perf_counter() - start_counter
             
             self.logger.error(
                 f"Operation failed: {operation}",
                 extra={
                     'operation': operation,
                     'duration_seconds': duration,
-                    'start_time': start_time.isoformat(),
-                    'end_time': end_time.isoformat(),
+                    'start_time': format_utc_timestamp(start_time),
+                    'end_time': format_utc_timestamp(start_time + duration),
                     'error_type': type(e).__name__,
                     **context
                 },
@@ -3,9 +3,14 @@ Exception handling utilities and custom exceptions
 """
 import functools
 import asyncio
-from typing import Type, Callable, Any, Optional
-from datetime import datetime
-
+import json
+import logging
+import os
+import time
+from typing import Type, Callable, Any, Collection, Optional
+from datetime import datetime, timezone
+
+from src.utils.helpers import get_file_extension
 from src.utils.logger import get_logger
 from src.utils.enhanced_logging import get_error_tracker
 
@@ -21,7 +26,7 @@ class InvoiceProcessingError(Exception):
         self.message = message
         self.error_code = error_code or "GENERAL_ERROR"
         self.file_id = file_id
-        self.timestamp = datetime.utcnow()
+        self.timestamp = datetime.now(timezone.utc)
 
 
 class FileProcessingError(InvoiceProcessingError):
@@ -64,6 +69,36 @@ class FileSystemError(InvoiceProcessingError):
         self.operation = operation
 
 
+def _make_error_reporter(func: Callable, log_error: bool, track_error: bool) -> Optional[Callable]:
+    """Build the error reporting step for a decorated function once, at decoration time
+    
+    Returns None when neither logging nor tracking is enabled.
+    """
+    if not (log_error or track_error):
+        return None
+    
+    name = func.__name__
+    
+    def report_error(e: Exception, args: tuple, kwargs: dict):
+        message = str(e)
+        
+        if log_error:
+            logger.error("Error in %s: %s", name, message, exc_info=True)
+        
+        if track_error:
+            error_tracker.track_error(
+                error_type=type(e).__name__,
+                error_message=message,
+                context={
+                    'function': name,
+                    'args': str(args)[:200],  # Limit length
+                    'kwargs': str(kwargs)[:200]
+                }
+            )
+    
+    return report_error
+
+
 def handle_exceptions(
     default_return=None,
     log_error: bool = True,
@@ -74,24 +109,15 @@ def handle_exceptions(
     """Decorator for handling exceptions in functions"""
     
     def decorator(func: Callable) -> Callable:
+        report_error = _make_error_reporter(func, log_error, track_error)
+        
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
             try:
                 return func(*args, **kwargs)
             except exception_types as e:
-                if log_error:
-                    logger.error(f"Error in {func.__name__}: {str(e)}", exc_info=True)
-                
-                if track_error:
-                    error_tracker.track_error(
-                        error_type=type(e).__name__,
-                        error_message=str(e),
-                        context={
-                            'function': func.__name__,
-                            'args': str(args)[:200],  # Limit length
-                            'kwargs': str(kwargs)[:200]
-                        }
-                    )
+                if report_error:
+                    report_error(e, args, kwargs)
                 
                 if reraise:
                     raise
@@ -113,24 +139,15 @@ def handle_async_exceptions(
     """Decorator for handling exceptions in async functions"""
     
     def decorator(func: Callable) -> Callable:
+        report_error = _make_error_reporter(func, log_error, track_error)
+        
         @functools.wraps(func)
         async def wrapper(*args, **kwargs):
             try:
                 return await func(*args, **kwargs)
             except exception_types as e:
-                if log_error:
-                    logger.error(f"Error in {func.__name__}: {str(e)}", exc_info=True)
-                
-                if track_error:
-                    error_tracker.track_error(
-                        error_type=type(e).__name__,
-                        error_message=str(e),
-                        context={
-                            'function': func.__name__,
-                            'args': str(args)[:200],
-                            'kwargs': str(kwargs)[:200]
-                        }
-                    )
+                if report_error:
+                    report_error(e, args, kwargs)
                 
                 if reraise:
                     raise
@@ -151,6 +168,10 @@ def retry_on_failure(
     """Decorator for retrying functions on failure"""
     
     def decorator(func: Callable) -> Callable:
+        # Nothing to retry, so skip the wrapper entirely
+        if max_attempts <= 1:
+            return func
+        
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
             last_exception = None
@@ -167,7 +188,6 @@ def retry_on_failure(
                             f"Attempt {attempt + 1} failed for {func.__name__}: {str(e)}. "
                             f"Retrying in {current_delay} seconds..."
                         )
-                        import time
                         time.sleep(current_delay)
                         current_delay *= backoff_factor
                     else:
@@ -191,6 +211,10 @@ def retry_async_on_failure(
     """Decorator for retrying async functions on failure"""
     
     def decorator(func: Callable) -> Callable:
+        # Nothing to retry, so skip the wrapper entirely
+        if max_attempts <= 1:
+            return func
+        
         @functools.wraps(func)
         async def wrapper(*args, **kwargs):
             last_exception = None
@@ -231,20 +255,21 @@ class ErrorContext:
         self.start_time = None
     
     def __enter__(self):
-        self.start_time = datetime.utcnow()
-        logger.debug(f"Starting operation: {self.operation}")
+        self.start_time = time.perf_counter()
+        logger.debug("Starting operation: %s", self.operation)
         return self
     
     def __exit__(self, exc_type, exc_val, exc_tb):
-        duration = (datetime.utcnow() - self.start_time).total_seconds()
+        duration = time.perf_counter() - self.start_time
         
         if exc_type is None:
-            logger.debug(f"Operation completed successfully: {self.operation} ({duration:.2f}s)")
+            logger.debug("Operation completed successfully: %s (%.2fs)", self.operation, duration)
         else:
-            logger.error(
-                f"Operation failed: {self.operation} ({duration:.2f}s) - {str(exc_val)}",
-                exc_info=(exc_type, exc_val, exc_tb)
-            )
+            if logger.isEnabledFor(logging.ERROR):
+                logger.error(
+                    "Operation failed: %s (%.2fs) - %s", self.operation, duration, exc_val,
+                    exc_info=(exc_type, exc_val, exc_tb)
+                )
             
             # Track error
             error_tracker.track_error(
@@ -262,11 +287,9 @@ class ErrorContext:
         return False
 
 
-def validate_file_format(filename: str, supported_formats: list) -> bool:
+def validate_file_format(filename: str, supported_formats: Collection[str]) -> bool:
     """Validate file format"""
-    from pathlib import Path
-    
-    extension = Path(filename).suffix.lower().lstrip('.')
+    extension = get_file_extension(filename)
     if extension not in supported_formats:
         raise ValidationError(
             f"Unsupported file format: {extension}. Supported formats: {supported_formats}",
@@ -277,10 +300,10 @@ def validate_file_format(filename: str, supported_formats: list) -> bool:
 
 def validate_file_size(file_path, max_size_mb: float) -> bool:
     """Validate file size"""
-    from pathlib import Path
-    
-    file_size_mb = Path(file_path).stat().st_size / (1024 * 1024)
-    if file_size_mb > max_size_mb:
+    # Compare in bytes; the size in MB is only needed for the error message
+    file_size = os.stat(file_path).st_size
+    if file_size > max_size_mb * (1024 * 1024):
+        file_size_mb = file_size / (1024 * 1024)
         raise ValidationError(
             f"File size ({file_size_mb:.2f}MB) exceeds maximum allowed size ({max_size_mb}MB)",
             field_name="file_size"
@@ -291,7 +314,6 @@ def validate_file_size(file_path, max_size_mb: float) -> bool:
 def safe_json_loads(json_str: str, default=None):
     """Safely load JSON with error handling"""
     try:
-        import json
         return json.loads(json_str)
     except (json.JSONDecodeError, TypeError) as e:
         logger.warning(f"Failed to parse JSON: {str(e)}")
@@ -307,7 +329,7 @@ def safe_file_operation(operation: Callable, *args, **kwargs):
     """Safely perform file operations with error handling"""
     try:
         return operation(*args, **kwargs)
-    except (OSError, IOError, PermissionError) as e:
+    except OSError as e:  # IOError and PermissionError are OSError
         raise FileSystemError(
             f"File operation failed: {str(e)}",
             operation=operation.__name__
@@ -1,31 +1,51 @@
 """
 Utility functions and helpers
 """
+import asyncio
 import hashlib
+import itertools
+import mmap
+import os
+import queue
+import re
+import time
 import uuid
-from datetime import datetime
+from datetime import datetime, timezone
 from pathlib import Path
-from typing import Optional
+from typing import Any, Awaitable, BinaryIO, Callable, Collection, Optional, Tuple
+
+# Characters not allowed in filenames, each replaced by an underscore
+_INVALID_FILENAME_CHARS = str.maketrans(dict.fromkeys('<>:"/\\|?*', '_'))
+_UNDERSCORE_RUN_RE = re.compile(r'_{2,}')
 
 
 def generate_file_id(filename: str) -> str:
-    """Generate unique file ID based on filename and timestamp"""
-    timestamp = datetime.utcnow().isoformat()
-    content = f"{filename}_{timestamp}_{uuid.uuid4()}"
-    return hashlib.md5(content.encode()).hexdigest()[:16]
+    """Generate unique file ID for a processing run of a file"""
+    # The random UUID alone makes the ID unique; hashing the filename and time in added nothing
+    return uuid.uuid4().hex[:16]
+
+
+def hash_file_content(file_path: Path, chunk_size: int = 1024 * 1024) -> str:
+    """Hash file contents so identical files can be recognised regardless of name"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file_path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
 
 
 def generate_timestamp_suffix() -> str:
     """Generate timestamp suffix for filenames"""
-    return datetime.utcnow().strftime("%Y%m%d_%H%M%S")
+    return datetime.now(timezone.utc).strftime("%Y%m%d_%H%M%S")
 
 
 def get_file_extension(filename: str) -> str:
     """Get file extension from filename"""
-    return Path(filename).suffix.lower().lstrip('.')
+    # splitext avoids building a Path for every watcher event and scanned entry
+    return os.path.splitext(filename)[1][1:].lower()
 
 
-def is_supported_format(filename: str, supported_formats: list) -> bool:
+def is_supported_format(filename: str, supported_formats: Collection[str]) -> bool:
     """Check if file format is supported"""
     extension = get_file_extension(filename)
     return extension in supported_formats
@@ -40,12 +60,10 @@ def create_timestamped_filename(original_filename: str, suffix: Optional[str] =
 
 def safe_filename(filename: str) -> str:
     """Create safe filename by removing/replacing invalid characters"""
-    import re
     # Remove or replace invalid characters
-    safe_name = re.sub(r'[<>:"/\\|?*]', '_', filename)
+    safe_name = filename.translate(_INVALID_FILENAME_CHARS)
     # Remove multiple underscores
-    safe_name = re.sub(r'_+', '_', safe_name)
-    return safe_name
+    return _UNDERSCORE_RUN_RE.sub('_', safe_name)
 
 
 def get_file_size_mb(file_path: Path) -> float:
@@ -56,31 +74,46 @@ def get_file_size_mb(file_path: Path) -> float:
 
 
 def ensure_unique_filename(target_path: Path) -> Path:
-    """Ensure filename is unique by adding counter if needed"""
-    if not target_path.exists():
-        return target_path
+    """Ensure filename is unique by adding counter if needed
     
-    counter = 1
-    original_path = target_path
+    The directory is listed once instead of stat-ing every candidate. The name
+    is not reserved; use create_unique_file when callers may race for it.
+    """
+    try:
+        with os.scandir(target_path.parent) as entries:
+            taken = {os.path.normcase(entry.name) for entry in entries}
+    except FileNotFoundError:
+        return target_path
     
-    while target_path.exists():
-        name_parts = original_path.stem, counter, original_path.suffix
-        target_path = original_path.parent / f"{name_parts[0]}_{name_parts[1]}{name_parts[2]}"
-        counter += 1
+    candidate = target_path
+    for counter in itertools.count(1):
+        if os.path.normcase(candidate.name) not in taken:
+            return candidate
+        candidate = target_path.with_name(f"{target_path.stem}_{counter}{target_path.suffix}")
+
+
+def create_unique_file(target_path: Path) -> Tuple[Path, BinaryIO]:
+    """Atomically create a new file for writing, adding a random suffix if the name is taken"""
+    flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0)
+    candidate = target_path
     
-    return target_path
+    while True:
+        try:
+            fd = os.open(candidate, flags, 0o644)
+        except FileExistsError:
+            candidate = target_path.with_name(f"{target_path.stem}_{uuid.uuid4().hex[:8]}{target_path.suffix}")
+            continue
+        return candidate, os.fdopen(fd, "wb")
 
 
 def format_duration(seconds: float) -> str:
     """Format duration in human-readable format"""
     if seconds < 60:
-        return f"{seconds:.2f} seconds"
+        return "%.2f seconds" % seconds
     elif seconds < 3600:
-        minutes = seconds / 60
-        return f"{minutes:.2f} minutes"
+        return "%.2f minutes" % (seconds / 60)
     else:
-        hours = seconds / 3600
-        return f"{hours:.2f} hours"
+        return "%.2f hours" % (seconds / 3600)
 
 
 def truncate_text(text: str, max_length: int = 100) -> str:
@@ -89,3 +122,52 @@ def truncate_text(text: str, max_length: int = 100) -> str:
         return text
     return text[:max_length-3] + "..."
 
+
+class BufferPool:
+    """Bounded pool of reusable page-aligned I/O buffers"""
+    
+    def __init__(self, buffer_size: int, max_buffers: int):
+        self.buffer_size = buffer_size
+        self._buffers: queue.LifoQueue = queue.LifoQueue(maxsize=max_buffers)
+    
+    def get(self) -> memoryview:
+        """Take a buffer from the pool, allocating a new one if it is empty"""
+        try:
+            return self._buffers.get_nowait()
+        except queue.Empty:
+            # Anonymous mmaps are page-aligned
+            return memoryview(mmap.mmap(-1, self.buffer_size))
+    
+    def put(self, buffer: memoryview) -> None:
+        """Return a buffer to the pool, dropping it if the pool is full"""
+        try:
+            self._buffers.put_nowait(buffer)
+        except queue.Full:
+            pass
+
+
+class AsyncTTLCache:
+    """Cache the result of an async function briefly, computing it once for concurrent callers"""
+    
+    def __init__(self, func: Callable[[], Awaitable[Any]], ttl_seconds: float):
+        self._func = func
+        self._ttl = ttl_seconds
+        self._value: Any = None
+        self._expires_at = float("-inf")
+        self._lock = asyncio.Lock()
+    
+    async def get(self) -> Any:
+        """Get the cached value, recomputing it if expired"""
+        if time.monotonic() < self._expires_at:
+            return self._value
+        
+        async with self._lock:
+            # Another caller may have refreshed while we waited
+            if time.monotonic() >= self._expires_at:
+                self._value = await self._func()
+                self._expires_at = time.monotonic() + self._ttl
+            return self._value
+    
+    def clear(self) -> None:
+        """Expire the cached value"""
+        self._expires_at = float("-inf")
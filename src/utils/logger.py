@@ -1,9 +1,14 @@
 """
 Logging configuration and utilities
 """
+import atexit
+import copy
 import logging
 import logging.handlers
+import os
+import queue
 import sys
+from functools import lru_cache
 from pathlib import Path
 from typing import Optional
 
@@ -22,12 +27,122 @@ class ColoredFormatter(logging.Formatter):
     }
     RESET = '\033[0m'
     
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.colored_levels = {
+            level: f"{color}{level}{self.RESET}" for level, color in self.COLORS.items()
+        }
+    
     def format(self, record):
-        log_color = self.COLORS.get(record.levelname, self.RESET)
-        record.levelname = f"{log_color}{record.levelname}{self.RESET}"
+        colored_level = self.colored_levels.get(record.levelname)
+        if colored_level is None:
+            return super().format(record)
+        # The record is shared with the file handlers, so colour a copy
+        record = copy.copy(record)
+        record.levelname = colored_level
         return super().format(record)
 
 
+@lru_cache(maxsize=1024)
+def is_processing_logger(name: str) -> bool:
+    """Check whether a logger name belongs in the processing logs (cached per name)"""
+    return 'processing' in name.lower()
+
+
+class LocalQueueHandler(logging.handlers.QueueHandler):
+    """Queue handler for a listener thread in the same process
+    
+    Unlike the base class, the record keeps its exception info so the
+    listener's formatters can render it themselves.
+    """
+    
+    def prepare(self, record):
+        # Merge arguments now, while they still hold their values at the call site
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class BatchedRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """Rotating file handler that writes through the stream buffer
+    
+    The base handler flushes after every record and seeks to the end of the
+    file to check its size, which also flushes. This one tracks the size
+    itself and is flushed by its BatchingQueueListener once the queue is
+    drained, so a burst of records costs a single write.
+    """
+    
+    _size = 0
+    _pending_size = 0
+    
+    def _open(self):
+        stream = super()._open()
+        self._size = os.fstat(stream.fileno()).st_size
+        return stream
+    
+    def shouldRollover(self, record):
+        if self.stream is None:
+            self.stream = self._open()
+        if self.maxBytes <= 0:
+            return False
+        # maxBytes and the file size are bytes, so count the encoded record
+        msg = self.format(record) + self.terminator
+        self._pending_size = len(msg.encode(self.stream.encoding, errors="replace"))
+        return self._size > 0 and self._size + self._pending_size >= self.maxBytes
+    
+    def doRollover(self):
+        super().doRollover()
+        self._size = 0
+    
+    def emit(self, record):
+        super().emit(record)
+        self._size += self._pending_size
+    
+    def flush(self):
+        # Called per record by emit; the listener calls flush_batch instead
+        pass
+    
+    def flush_batch(self):
+        """Write out buffered records"""
+        super().flush()
+
+
+class BatchingQueueListener(logging.handlers.QueueListener):
+    """Queue listener that flushes its handlers whenever the queue runs empty"""
+    
+    def handle(self, record):
+        super().handle(record)
+        if self.queue.empty():
+            for handler in self.handlers:
+                getattr(handler, 'flush_batch', handler.flush)()
+
+
+def start_queue_listener(logger: logging.Logger, *handlers: logging.Handler) -> logging.handlers.QueueListener:
+    """Attach handlers to a logger through a queue drained by a background thread
+    
+    Logging calls only enqueue the record; formatting and file I/O run on
+    the listener thread, which is flushed and stopped at exit.
+    """
+    log_queue = queue.SimpleQueue()
+    listener = BatchingQueueListener(log_queue, *handlers, respect_handler_level=True)
+    logger.addHandler(LocalQueueHandler(log_queue))
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+def stop_queue_listener(listener: logging.handlers.QueueListener):
+    """Stop a listener started by start_queue_listener and close its handlers"""
+    listener.stop()
+    # Its exit hook would stop it again, which fails once the thread is gone
+    atexit.unregister(listener.stop)
+    for handler in listener.handlers:
+        handler.close()
+
+
+_root_listener: Optional[logging.handlers.QueueListener] = None
+
+
 def setup_logging():
     """Setup application logging configuration"""
     
@@ -39,6 +154,10 @@ def setup_logging():
     root_logger.setLevel(getattr(logging, settings.log_level.upper()))
     
     # Clear existing handlers
+    global _root_listener
+    if _root_listener is not None:
+        stop_queue_listener(_root_listener)
+        _root_listener = None
     root_logger.handlers.clear()
     
     # Console handler with colors
@@ -49,11 +168,10 @@ def setup_logging():
     )
     console_handler.setFormatter(console_formatter)
     console_handler.setLevel(logging.INFO)
-    root_logger.addHandler(console_handler)
     
     # File handler with rotation
     log_file = settings.log_path / "invoice_agent.log"
-    file_handler = logging.handlers.RotatingFileHandler(
+    file_handler = BatchedRotatingFileHandler(
         log_file,
         maxBytes=settings.log_max_size_mb * 1024 * 1024,
         backupCount=settings.log_backup_count,
@@ -65,11 +183,10 @@ def setup_logging():
     )
     file_handler.setFormatter(file_formatter)
     file_handler.setLevel(getattr(logging, settings.log_level.upper()))
-    root_logger.addHandler(file_handler)
     
     # Error file handler
     error_log_file = settings.log_path / "errors.log"
-    error_handler = logging.handlers.RotatingFileHandler(
+    error_handler = BatchedRotatingFileHandler(
         error_log_file,
         maxBytes=settings.log_max_size_mb * 1024 * 1024,
         backupCount=settings.log_backup_count,
@@ -77,19 +194,22 @@ def setup_logging():
     )
     error_handler.setFormatter(file_formatter)
     error_handler.setLevel(logging.ERROR)
-    root_logger.addHandler(error_handler)
     
     # Processing log handler
     processing_log_file = settings.log_path / "processing.log"
-    processing_handler = logging.handlers.RotatingFileHandler(
+    processing_handler = BatchedRotatingFileHandler(
         processing_log_file,
         maxBytes=settings.log_max_size_mb * 1024 * 1024,
         backupCount=settings.log_backup_count,
         encoding='utf-8'
     )
     processing_handler.setFormatter(file_formatter)
-    processing_handler.addFilter(lambda record: 'processing' in record.name.lower())
-    root_logger.addHandler(processing_handler)
+    processing_handler.addFilter(lambda record: is_processing_logger(record.name))
+    
+    # Handlers run on a listener thread so logging calls never wait on file I/O
+    _root_listener = start_queue_listener(
+        root_logger, console_handler, file_handler, error_handler, processing_handler
+    )
 
 
 def get_logger(name: str) -> logging.Logger:
@@ -2,37 +2,60 @@
 Test configuration and fixtures
 """
 import pytest
-import asyncio
-import tempfile
-import shutil
+import io
+import os
 from pathlib import Path
-from unittest.mock import Mock, AsyncMock
+from unittest.mock import Mock, AsyncMock, patch
 import json
 
-from config.settings import Settings
+from config.settings import Settings, ensure_directories
 from src.services.invoice_processor import InvoiceProcessorService
 from src.services.file_monitor import FileMonitorService
 from src.models import InvoiceData, ProcessingResult, ProcessingStatus
 
 
-@pytest.fixture
-def temp_directories():
-    """Create temporary directories for testing"""
-    temp_dir = Path(tempfile.mkdtemp())
-    
+# Successful model response, serialized once for every test
+MOCK_LLM_RESPONSE_CONTENT = json.dumps({
+    "invoice_number": "TEST-001",
+    "date": "2024-01-15",
+    "vendor_name": "Test Vendor",
+    "total_amount": 100.00,
+    "currency": "USD",
+    "line_items": [
+        {
+            "description": "Test Item",
+            "quantity": 1,
+            "unit_price": 100.00,
+            "total": 100.00
+        }
+    ]
+})
+
+
+@pytest.fixture(scope="session", autouse=True)
+def app_directories():
+    """Create the configured app directories (normally done at startup)"""
+    ensure_directories()
+
+
+def _create_directories(base_path: Path) -> dict:
+    """Create the incoming, generated and logs folders under base_path"""
     directories = {
-        'incoming': temp_dir / 'incoming',
-        'generated': temp_dir / 'generated',
-        'logs': temp_dir / 'logs'
+        'incoming': base_path / 'incoming',
+        'generated': base_path / 'generated',
+        'logs': base_path / 'logs'
     }
     
     for directory in directories.values():
-        directory.mkdir(parents=True, exist_ok=True)
-    
-    yield directories
+        directory.mkdir()
     
-    # Cleanup
-    shutil.rmtree(temp_dir, ignore_errors=True)
+    return directories
+
+
+@pytest.fixture
+def temp_directories(tmp_path):
+    """Create temporary directories for testing (pytest prunes old tmp_path runs)"""
+    return _create_directories(tmp_path)
 
 
 @pytest.fixture
@@ -49,32 +72,29 @@ def test_settings(temp_directories):
     return settings
 
 
+@pytest.fixture(scope="module")
+def module_llm():
+    """Mock LangChain LLM shared by a test module, with ChatOllama patched out"""
+    with patch('src.services.invoice_processor.ChatOllama') as chat_ollama:
+        mock = chat_ollama.return_value
+        mock.ainvoke = AsyncMock()
+        yield mock
+
+
 @pytest.fixture
-def mock_llm():
-    """Mock LangChain LLM for testing"""
-    mock = Mock()
+def mock_llm(module_llm):
+    """Mock LangChain LLM for testing, reset for each test"""
+    # Clear calls recorded by earlier tests
+    module_llm.reset_mock()
     
     # Mock successful response
     mock_response = Mock()
-    mock_response.content = json.dumps({
-        "invoice_number": "TEST-001",
-        "date": "2024-01-15",
-        "vendor_name": "Test Vendor",
-        "total_amount": 100.00,
-        "currency": "USD",
-        "line_items": [
-            {
-                "description": "Test Item",
-                "quantity": 1,
-                "unit_price": 100.00,
-                "total": 100.00
-            }
-        ]
-    })
+    mock_response.content = MOCK_LLM_RESPONSE_CONTENT
     
-    # Make invoke return the mock response directly (not async)
-    mock.invoke.return_value = mock_response
-    return mock
+    # Make ainvoke an awaitable returning the mock response, undoing per-test overrides
+    module_llm.ainvoke.side_effect = None
+    module_llm.ainvoke.return_value = mock_response
+    return module_llm
 
 
 @pytest.fixture
@@ -97,15 +117,34 @@ def sample_invoice_data():
     )
 
 
-@pytest.fixture
-def sample_image_file(temp_directories):
-    """Create a sample image file for testing"""
+@pytest.fixture(scope="session")
+def sample_image_bytes():
+    """Encode a simple test JPEG once for the whole session"""
     from PIL import Image
     
-    # Create a simple test image
     img = Image.new('RGB', (100, 100), color='white')
+    buffer = io.BytesIO()
+    img.save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+@pytest.fixture(scope="session")
+def master_image_file(tmp_path_factory, sample_image_bytes):
+    """Write the sample JPEG to disk once for the whole session"""
+    image_path = tmp_path_factory.mktemp('images') / 'sample_invoice.jpg'
+    image_path.write_bytes(sample_image_bytes)
+    return image_path
+
+
+@pytest.fixture
+def sample_image_file(temp_directories, master_image_file, sample_image_bytes):
+    """Create a sample image file for testing"""
     image_path = temp_directories['incoming'] / 'test_invoice.jpg'
-    img.save(image_path, 'JPEG')
+    try:
+        # Tests move or read the file but never write to it, so a hard link is safe
+        os.link(master_image_file, image_path)
+    except OSError:
+        image_path.write_bytes(sample_image_bytes)
     
     return image_path
 
@@ -113,21 +152,38 @@ def sample_image_file(temp_directories):
 @pytest.fixture
 def invoice_processor_service(test_settings, mock_llm):
     """Create invoice processor service with mocked dependencies"""
-    service = InvoiceProcessorService()
-    service.llm = mock_llm
-    return service
+    # Point the services at this test's directories so tests (and xdist
+    # workers) never share the incoming and generated folders
+    with patch('src.services.invoice_processor.settings', test_settings), \
+         patch('src.services.file_monitor.settings', test_settings):
+        # Results and stats live on the service, so each test gets its own; mock_llm
+        # keeps ChatOllama patched, so no real Ollama client is built
+        service = InvoiceProcessorService()
+        service.llm = mock_llm
+        yield service
 
 
 @pytest.fixture
-def file_monitor_service(invoice_processor_service):
-    """Create file monitor service"""
-    return FileMonitorService(invoice_processor_service)
+def fake_observer():
+    """Replace the watchdog Observer so monitoring starts no thread or inotify watches"""
+    with patch('src.services.file_monitor.Observer', autospec=True) as observer_class:
+        yield observer_class
 
 
 @pytest.fixture
-def event_loop():
-    """Create event loop for async tests"""
-    loop = asyncio.new_event_loop()
-    yield loop
-    loop.close()
+def fast_monitor_timings(monkeypatch):
+    """Shrink the file monitor's batching and write-settle waits to a few milliseconds"""
+    monkeypatch.setattr('src.services.file_monitor.BATCH_MAX_WAIT_SECONDS', 0.01)
+    monkeypatch.setattr('src.services.file_monitor.FILE_SETTLE_INTERVAL_SECONDS', 0.01)
 
+
+@pytest.fixture
+def patched_encoder(monkeypatch):
+    """Skip the image read and base64 encode for tests of the rest of the pipeline"""
+    monkeypatch.setattr(InvoiceProcessorService, '_encode_image_to_base64', lambda self, image_path: "AAAA")
+
+
+@pytest.fixture
+def file_monitor_service(invoice_processor_service):
+    """Create file monitor service"""
+    return FileMonitorService(invoice_processor_service)
@@ -2,12 +2,16 @@
 """
 Integration test script for AI Invoice Processing Agent
 """
+import argparse
 import asyncio
+import io
 import sys
 import time
+from functools import cached_property
 import requests
 import json
 from pathlib import Path
+from typing import Optional
 from PIL import Image
 import tempfile
 import shutil
@@ -18,14 +22,29 @@ sys.path.insert(0, str(Path(__file__).parent.parent))
 from config.settings import settings
 
 
+def poll_until(predicate, timeout: float = 15.0, interval: float = 0.1) -> bool:
+    """Call predicate until it returns True or timeout seconds pass"""
+    deadline = time.monotonic() + timeout
+    while True:
+        if predicate():
+            return True
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(interval)
+
+
 class IntegrationTester:
     """Integration tester for the complete system"""
     
-    def __init__(self):
+    def __init__(self, live: bool = False):
+        # In-process by default; live mode talks to running API and dashboard servers over HTTP
+        self.live = live
+        self.http = requests
         self.api_base_url = f"http://{settings.host}:{settings.port}"
         self.dashboard_url = f"http://{settings.host}:{settings.dashboard_port}"
         self.test_results = []
         self.temp_dir = None
+        self.client = None
     
     def setup(self):
         """Setup test environment"""
@@ -40,19 +59,42 @@ class IntegrationTester:
         settings.generated_path.mkdir(parents=True, exist_ok=True)
         settings.log_path.mkdir(parents=True, exist_ok=True)
         
+        if not self.live:
+            # Drive the ASGI app directly; entering the client runs its startup and shutdown
+            from fastapi.testclient import TestClient
+            from src.api.main import app
+            
+            self.client = TestClient(app, raise_server_exceptions=False)
+            self.client.__enter__()
+            self.http = self.client
+            self.api_base_url = str(self.client.base_url)
+            print("🧪 Running against the API in-process (use --live for running servers)")
+        
         print("✅ Test environment setup complete")
     
     def cleanup(self):
         """Cleanup test environment"""
         print("🧹 Cleaning up test environment...")
         
+        if self.client is not None:
+            self.client.__exit__(None, None, None)
+            self.client = None
+        
         if self.temp_dir and self.temp_dir.exists():
             shutil.rmtree(self.temp_dir, ignore_errors=True)
         
         print("✅ Cleanup complete")
     
-    def create_test_invoice_image(self, filename: str) -> Path:
-        """Create a test invoice image"""
+    def create_test_invoice_image(self, filename: str, directory: Optional[Path] = None) -> Path:
+        """Create a test invoice image (in the temp directory unless given another one)"""
+        image_path = (directory or self.temp_dir) / filename
+        image_path.write_bytes(self.test_invoice_jpeg)
+        
+        return image_path
+    
+    @cached_property
+    def test_invoice_jpeg(self) -> bytes:
+        """Encode the test invoice image once and reuse its bytes"""
         # Create a simple test image with some text-like patterns
         img = Image.new('RGB', (800, 600), color='white')
         
@@ -72,18 +114,17 @@ class IntegrationTester:
         # Total area
         draw.rectangle([500, 520, 750, 570], fill='lightgreen')
         
-        # Save image
-        image_path = self.temp_dir / filename
-        img.save(image_path, 'JPEG')
-        
-        return image_path
+        # Encode image
+        buffer = io.BytesIO()
+        img.save(buffer, 'JPEG')
+        return buffer.getvalue()
     
     def test_api_health(self) -> bool:
         """Test API health endpoint"""
         print("🏥 Testing API health...")
         
         try:
-            response = requests.get(f"{self.api_base_url}/", timeout=10)
+            response = self.http.get(f"{self.api_base_url}/", timeout=10)
             
             if response.status_code == 200:
                 data = response.json()
@@ -108,7 +149,7 @@ class IntegrationTester:
             # Upload file
             with open(test_image, 'rb') as f:
                 files = {"file": ("test_upload.jpg", f, "image/jpeg")}
-                response = requests.post(f"{self.api_base_url}/upload", files=files, timeout=30)
+                response = self.http.post(f"{self.api_base_url}/upload", files=files, timeout=30)
             
             if response.status_code == 200:
                 data = response.json()
@@ -123,19 +164,28 @@ class IntegrationTester:
             print(f"❌ File upload test failed - Error: {str(e)}")
             return False
     
+    def get_stat(self, name: str) -> int:
+        """Get a single processing statistic from the API, or -1 if unavailable"""
+        try:
+            response = self.http.get(f"{self.api_base_url}/stats", timeout=10)
+            if response.status_code == 200:
+                return response.json().get(name, 0)
+        except requests.exceptions.RequestException:
+            pass
+        return -1
+    
     def test_manual_processing(self) -> bool:
         """Test manual processing trigger"""
         print("⚙️ Testing manual processing...")
         
         try:
             # Create test image in incoming folder
-            test_image = self.create_test_invoice_image("test_manual.jpg")
-            target_path = settings.incoming_path / "test_manual.jpg"
-            shutil.copy2(test_image, target_path)
+            self.create_test_invoice_image("test_manual.jpg", settings.incoming_path)
+            processed_before = self.get_stat('total_processed')
             
             # Trigger processing
             request_data = {"force_reprocess": True}
-            response = requests.post(f"{self.api_base_url}/process", json=request_data, timeout=30)
+            response = self.http.post(f"{self.api_base_url}/process", json=request_data, timeout=30)
             
             if response.status_code == 200:
                 data = response.json()
@@ -143,7 +193,7 @@ class IntegrationTester:
                 
                 # Wait for processing to complete
                 print("⏳ Waiting for processing to complete...")
-                time.sleep(10)
+                poll_until(lambda: self.get_stat('total_processed') > processed_before, timeout=10)
                 
                 return True
             else:
@@ -159,7 +209,7 @@ class IntegrationTester:
         print("📊 Testing statistics endpoint...")
         
         try:
-            response = requests.get(f"{self.api_base_url}/stats", timeout=10)
+            response = self.http.get(f"{self.api_base_url}/stats", timeout=10)
             
             if response.status_code == 200:
                 data = response.json()
@@ -179,7 +229,7 @@ class IntegrationTester:
         print("📋 Testing results endpoint...")
         
         try:
-            response = requests.get(f"{self.api_base_url}/results", timeout=10)
+            response = self.http.get(f"{self.api_base_url}/results", timeout=10)
             
             if response.status_code == 200:
                 data = response.json()
@@ -203,7 +253,7 @@ class IntegrationTester:
         print("🖥️ Testing dashboard accessibility...")
         
         try:
-            response = requests.get(self.dashboard_url, timeout=10)
+            response = self.http.get(self.dashboard_url, timeout=10)
             
             if response.status_code == 200:
                 print("✅ Dashboard is accessible")
@@ -225,16 +275,19 @@ class IntegrationTester:
             # Create multiple test images
             test_images = []
             for i in range(3):
-                image_path = self.create_test_invoice_image(f"workflow_test_{i}.jpg")
-                target_path = settings.incoming_path / f"workflow_test_{i}.jpg"
-                shutil.copy2(image_path, target_path)
-                test_images.append(target_path)
+                test_images.append(
+                    self.create_test_invoice_image(f"workflow_test_{i}.jpg", settings.incoming_path)
+                )
             
             print(f"📁 Created {len(test_images)} test files in incoming folder")
             
             # Wait for automatic processing
             print("⏳ Waiting for automatic processing...")
-            time.sleep(15)
+            poll_until(
+                lambda: len(list(settings.generated_path.glob("workflow_test_*.json"))) >= len(test_images)
+                and not any(settings.incoming_path.glob("workflow_test_*.jpg")),
+                timeout=15
+            )
             
             # Check if files were processed
             generated_files = list(settings.generated_path.glob("workflow_test_*.json"))
@@ -275,20 +328,22 @@ class IntegrationTester:
             with open(invalid_file, 'w') as f:
                 f.write("This is not an image file")
             
+            failed_before = self.get_stat('failed')
+            
             # Try to upload invalid file
             with open(invalid_file, 'rb') as f:
                 files = {"file": ("invalid.jpg", f, "image/jpeg")}
-                response = requests.post(f"{self.api_base_url}/upload", files=files, timeout=30)
+                response = self.http.post(f"{self.api_base_url}/upload", files=files, timeout=30)
             
             # Should still accept upload (validation happens during processing)
             if response.status_code == 200:
                 print("✅ Invalid file upload handled gracefully")
                 
                 # Wait and check if error was logged properly
-                time.sleep(5)
+                poll_until(lambda: self.get_stat('failed') > failed_before, timeout=5)
                 
                 # Check statistics for failed processing
-                stats_response = requests.get(f"{self.api_base_url}/stats", timeout=10)
+                stats_response = self.http.get(f"{self.api_base_url}/stats", timeout=10)
                 if stats_response.status_code == 200:
                     stats = stats_response.json()
                     print(f"📊 Failed processing count: {stats.get('failed', 0)}")
@@ -302,6 +357,21 @@ class IntegrationTester:
             print(f"❌ Error handling test failed - Error: {str(e)}")
             return False
     
+    def run_test(self, test_name: str, test_func) -> str:
+        """Run a single test and return its status"""
+        try:
+            return "PASSED" if test_func() else "FAILED"
+        except Exception as e:
+            print(f"❌ Test {test_name} crashed - Error: {str(e)}")
+            return "CRASHED"
+    
+    async def run_probes(self, probes) -> list:
+        """Run independent read-only tests concurrently"""
+        return await asyncio.gather(*(
+            asyncio.to_thread(self.run_test, test_name, test_func)
+            for test_name, test_func in probes
+        ))
+    
     def run_all_tests(self):
         """Run all integration tests"""
         print("🚀 Starting AI Invoice Processing Agent Integration Tests")
@@ -309,34 +379,36 @@ class IntegrationTester:
         
         self.setup()
         
-        tests = [
+        # Read-only checks don't depend on each other, so their round trips overlap
+        probes = [
             ("API Health Check", self.test_api_health),
-            ("File Upload", self.test_file_upload),
-            ("Manual Processing", self.test_manual_processing),
             ("Statistics Endpoint", self.test_statistics_endpoint),
             ("Results Endpoint", self.test_results_endpoint),
-            ("Dashboard Accessibility", self.test_dashboard_accessibility),
+        ]
+        if self.live:
+            # The Streamlit dashboard only exists as a separate server
+            probes.append(("Dashboard Accessibility", self.test_dashboard_accessibility))
+        
+        tests = [
+            ("File Upload", self.test_file_upload),
+            ("Manual Processing", self.test_manual_processing),
             ("Complete Workflow", self.test_file_processing_workflow),
             ("Error Handling", self.test_error_handling),
         ]
         
-        passed = 0
-        total = len(tests)
+        total = len(probes) + len(tests)
+        
+        print(f"\n📋 Running concurrently: {', '.join(name for name, _ in probes)}")
+        print("-" * 40)
+        statuses = asyncio.run(self.run_probes(probes))
+        self.test_results.extend(zip((name for name, _ in probes), statuses))
         
         for test_name, test_func in tests:
             print(f"\n📋 Running: {test_name}")
             print("-" * 40)
-            
-            try:
-                result = test_func()
-                if result:
-                    passed += 1
-                    self.test_results.append((test_name, "PASSED"))
-                else:
-                    self.test_results.append((test_name, "FAILED"))
-            except Exception as e:
-                print(f"❌ Test {test_name} crashed - Error: {str(e)}")
-                self.test_results.append((test_name, "CRASHED"))
+            self.test_results.append((test_name, self.run_test(test_name, test_func)))
+        
+        passed = sum(1 for _, status in self.test_results if status == "PASSED")
         
         # Print summary
         print("\n" + "=" * 60)
@@ -361,7 +433,14 @@ class IntegrationTester:
 
 def main():
     """Main function"""
-    tester = IntegrationTester()
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--live", action="store_true",
+        help="test running API and dashboard servers over HTTP instead of the app in-process"
+    )
+    args = parser.parse_args()
+    
+    tester = IntegrationTester(live=args.live)
     success = tester.run_all_tests()
     
     sys.exit(0 if success else 1)
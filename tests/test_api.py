@@ -4,31 +4,31 @@ Integration tests for FastAPI endpoints
 import pytest
 import asyncio
 from fastapi.testclient import TestClient
-from unittest.mock import Mock, patch, AsyncMock
+from unittest.mock import patch, AsyncMock
 import json
 import io
-from PIL import Image
 
 from src.api.main import app
-from src.models import ProcessingStatus
+from src.models import ProcessingResult, ProcessingStatus, SystemStats
+
+
+@pytest.fixture(scope="module")
+def client():
+    """Create test client shared by the module (requests keep no client state)"""
+    return TestClient(app)
 
 
 class TestAPIEndpoints:
     """Test cases for API endpoints"""
     
-    @pytest.fixture
-    def client(self):
-        """Create test client"""
-        return TestClient(app)
-    
     @pytest.fixture
     def mock_services(self):
         """Mock the global services"""
         with patch('src.api.main.invoice_processor') as mock_processor, \
              patch('src.api.main.file_monitor') as mock_monitor:
             
-            # Setup mock processor
-            mock_processor.get_statistics.return_value = AsyncMock(return_value=Mock(
+            # Setup mock processor (coroutine methods return plain values when awaited)
+            mock_processor.get_statistics = AsyncMock(return_value=SystemStats(
                 total_processed=10,
                 successful=8,
                 failed=2,
@@ -38,12 +38,14 @@ class TestAPIEndpoints:
                 uptime="1 day"
             ))
             
-            mock_processor.get_recent_results.return_value = AsyncMock(return_value=[])
-            mock_processor.process_files.return_value = AsyncMock()
-            mock_processor.delete_result.return_value = AsyncMock(return_value=True)
+            mock_processor.get_recent_results = AsyncMock(return_value=[])
+            mock_processor.process_files = AsyncMock()
+            mock_processor.delete_result = AsyncMock(return_value=True)
             
             # Setup mock monitor
             mock_monitor.is_running = True
+            mock_monitor.get_queue_size.return_value = 0
+            mock_monitor.get_dropped_count.return_value = 0
             
             yield mock_processor, mock_monitor
     
@@ -85,12 +87,6 @@ class TestAPIEndpoints:
         assert "failed" in data
         assert "average_processing_time" in data
     
-    def test_get_processing_stats_service_unavailable(self, client):
-        """Test processing stats when service is unavailable"""
-        with patch('src.api.main.invoice_processor', None):
-            response = client.get("/stats")
-            assert response.status_code == 503
-    
     def test_trigger_processing(self, client, mock_services):
         """Test manual processing trigger"""
         mock_processor, mock_monitor = mock_services
@@ -107,24 +103,25 @@ class TestAPIEndpoints:
         assert data["success"] is True
         assert "Processing triggered successfully" in data["message"]
     
-    def test_trigger_processing_service_unavailable(self, client):
-        """Test processing trigger when service is unavailable"""
+    @pytest.mark.parametrize("method,url", [
+        ("GET", "/stats"),
+        ("POST", "/process"),
+        ("GET", "/results"),
+        ("DELETE", "/results/test123"),
+    ])
+    def test_service_unavailable(self, client, method, url):
+        """Test endpoints when the invoice processor is unavailable"""
         with patch('src.api.main.invoice_processor', None):
-            response = client.post("/process", json={})
+            response = client.request(method, url, json={} if method == "POST" else None)
             assert response.status_code == 503
     
-    def test_upload_invoice_success(self, client, temp_directories):
+    def test_upload_invoice_success(self, client, test_settings, temp_directories, sample_image_bytes):
         """Test successful invoice upload"""
-        # Create test image
-        img = Image.new('RGB', (100, 100), color='white')
-        img_bytes = io.BytesIO()
-        img.save(img_bytes, format='JPEG')
-        img_bytes.seek(0)
+        # Test image
+        img_bytes = io.BytesIO(sample_image_bytes)
         
-        with patch('config.settings.settings') as mock_settings:
-            mock_settings.incoming_path = temp_directories['incoming']
-            mock_settings.supported_formats_list = ['jpg', 'jpeg', 'png']
-            
+        # Save into this test's incoming folder, not the shared one (xdist workers run concurrently)
+        with patch('src.api.main.settings', test_settings):
             files = {"file": ("test_invoice.jpg", img_bytes, "image/jpeg")}
             response = client.post("/upload", files=files)
         
@@ -134,6 +131,7 @@ class TestAPIEndpoints:
         assert "uploaded successfully" in data["message"]
         assert "filename" in data["data"]
         assert "size" in data["data"]
+        assert (temp_directories['incoming'] / "test_invoice.jpg").read_bytes() == sample_image_bytes
     
     def test_upload_invoice_unsupported_format(self, client):
         """Test upload with unsupported file format"""
@@ -162,16 +160,15 @@ class TestAPIEndpoints:
         mock_processor, mock_monitor = mock_services
         
         # Mock results
-        mock_results = [
-            {
-                "file_id": "test123",
-                "original_filename": "test.jpg",
-                "status": "success",
-                "processing_time": 2.5,
-                "created_at": "2024-01-01T12:00:00Z"
-            }
+        mock_processor.get_recent_results.return_value = [
+            ProcessingResult(
+                file_id="test123",
+                original_filename="test.jpg",
+                processed_filename="test123.json",
+                status=ProcessingStatus.SUCCESS,
+                processing_time=2.5
+            )
         ]
-        mock_processor.get_recent_results.return_value = AsyncMock(return_value=mock_results)
         
         response = client.get("/results")
         
@@ -191,11 +188,30 @@ class TestAPIEndpoints:
         # Verify limit parameter was passed
         mock_processor.get_recent_results.assert_called_with(10)
     
-    def test_get_processing_results_service_unavailable(self, client):
-        """Test getting results when service is unavailable"""
-        with patch('src.api.main.invoice_processor', None):
-            response = client.get("/results")
-            assert response.status_code == 503
+    def test_get_processing_results_not_modified(self, client, mock_services):
+        """Test conditional results request with a matching ETag"""
+        mock_processor, mock_monitor = mock_services
+        
+        mock_processor.get_recent_results = AsyncMock(return_value=[
+            ProcessingResult(
+                file_id="test123",
+                original_filename="test.jpg",
+                processed_filename="test123.json",
+                status=ProcessingStatus.SUCCESS
+            )
+        ])
+        
+        response = client.get("/results")
+        assert response.status_code == 200
+        etag = response.headers["ETag"]
+        
+        response = client.get("/results", headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.headers["ETag"] == etag
+        
+        response = client.get("/results", headers={"If-None-Match": '"stale"'})
+        assert response.status_code == 200
+        assert response.json()[0]["file_id"] == "test123"
     
     def test_delete_processing_result_success(self, client, mock_services):
         """Test successful result deletion"""
@@ -216,7 +232,7 @@ class TestAPIEndpoints:
     def test_delete_processing_result_not_found(self, client, mock_services):
         """Test deleting non-existent result"""
         mock_processor, mock_monitor = mock_services
-        mock_processor.delete_result.return_value = AsyncMock(return_value=False)
+        mock_processor.delete_result.return_value = False
         
         file_id = "nonexistent"
         response = client.delete(f"/results/{file_id}")
@@ -224,12 +240,6 @@ class TestAPIEndpoints:
         assert response.status_code == 404
         assert "not found" in response.json()["detail"]
     
-    def test_delete_processing_result_service_unavailable(self, client):
-        """Test deleting result when service is unavailable"""
-        with patch('src.api.main.invoice_processor', None):
-            response = client.delete("/results/test123")
-            assert response.status_code == 503
-    
     def test_get_recent_logs(self, client):
         """Test getting recent logs"""
         response = client.get("/logs")
@@ -249,8 +259,9 @@ class TestAPIEndpoints:
         assert isinstance(data, list)
     
     def test_cors_headers(self, client):
-        """Test CORS headers are present"""
-        response = client.options("/")
+        """Smoke test that cross-origin requests get CORS headers"""
+        # A plain cross-origin GET is enough; no preflight OPTIONS round trip
+        response = client.get("/", headers={"Origin": "http://dashboard.example"})
         
         # CORS headers should be present
         assert "access-control-allow-origin" in response.headers
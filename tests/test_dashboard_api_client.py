@@ -0,0 +1,51 @@
+"""
+Unit tests for the dashboard API client
+"""
+import pytest
+from unittest.mock import Mock, patch
+
+from dashboard import api_client
+
+
+@pytest.fixture
+def mock_session():
+    """Mock HTTP session with an empty ETag cache"""
+    session = Mock()
+    with patch.object(api_client, 'get_session', return_value=session), \
+         patch.dict(api_client._etag_cache, clear=True):
+        yield session
+
+
+class TestFetchApiData:
+    """Test cases for conditional API fetches"""
+    
+    def test_not_modified_reuses_cached_payload(self, mock_session):
+        """Test that a 304 returns the payload saved with the ETag"""
+        payload = [{"file_id": "test123"}]
+        mock_session.get.side_effect = [
+            Mock(status_code=200, headers={"ETag": '"abc"'}, json=Mock(return_value=payload)),
+            Mock(status_code=304, headers={"ETag": '"abc"'}),
+        ]
+        
+        first = api_client.fetch_api_data("/results?limit=20")
+        second = api_client.fetch_api_data("/results?limit=20")
+        
+        assert first == (payload, None)
+        assert second == (payload, None)
+        # The second request is conditional on the saved ETag
+        assert mock_session.get.call_args_list[0].kwargs["headers"] is None
+        assert mock_session.get.call_args_list[1].kwargs["headers"] == {"If-None-Match": '"abc"'}
+    
+    def test_changed_payload_replaces_cached_etag(self, mock_session):
+        """Test that a 200 with a new ETag replaces the saved payload"""
+        mock_session.get.side_effect = [
+            Mock(status_code=200, headers={"ETag": '"old"'}, json=Mock(return_value=["old"])),
+            Mock(status_code=200, headers={"ETag": '"new"'}, json=Mock(return_value=["new"])),
+        ]
+        
+        api_client.fetch_api_data("/results")
+        data, error = api_client.fetch_api_data("/results")
+        
+        assert data == ["new"]
+        assert error is None
+        assert api_client._etag_cache["/results"] == ('"new"', ["new"])
@@ -3,11 +3,12 @@ Unit tests for file monitor service
 """
 import pytest
 import asyncio
+import msgspec
 from pathlib import Path
 from unittest.mock import Mock, patch, AsyncMock
 import time
 
-from src.services.file_monitor import FileMonitorService, InvoiceFileHandler
+from src.services.file_monitor import FileMonitorService, InvoiceFileHandler, NewestFirstQueue
 from src.services.invoice_processor import InvoiceProcessorService
 
 
@@ -50,20 +51,77 @@ class TestInvoiceFileHandler:
     
     @pytest.mark.asyncio
     async def test_queue_file_for_processing(self, invoice_processor_service, temp_directories):
-        """Test queuing file for processing"""
+        """Test queuing file for processing, once per file until it is processed"""
         handler = InvoiceFileHandler(invoice_processor_service)
+        handler.processing_queue = NewestFirstQueue(maxsize=2)
         
         # Create test file
         test_file = temp_directories['incoming'] / 'test.jpg'
         test_file.touch()
         
-        # Queue file
-        await handler._queue_file_for_processing(test_file)
+        # Queue file; repeated events for it are ignored
+        handler.enqueue_file(test_file)
+        handler.enqueue_file(test_file)
         
         # Check queue
         assert handler.processing_queue.qsize() == 1
+        assert handler.queued_files == {test_file}
+        
+        # A full queue sheds the oldest file, which may then be queued again
+        others = [temp_directories['incoming'] / f'other_{i}.jpg' for i in range(2)]
+        for path in others:
+            handler.enqueue_file(path)
+        
+        assert handler.dropped_files == 1
+        assert handler.queued_files == set(others)
+        
+        handler.enqueue_file(test_file)
+        assert test_file in handler.queued_files
         queued_file = await handler.processing_queue.get()
         assert queued_file == test_file
+        
+        # Once processed, the file can be queued by later events
+        handler.mark_processed([test_file])
+        assert test_file not in handler.queued_files
+    
+    @pytest.mark.asyncio
+    async def test_close_event_rearms_queued_file(self, invoice_processor_service, temp_directories):
+        """Test that a close event for a file being checked queues it again afterwards"""
+        handler = InvoiceFileHandler(invoice_processor_service)
+        test_file = temp_directories['incoming'] / 'test.jpg'
+        
+        # Closed before its check starts: one pass covers it
+        handler.enqueue_file(test_file)
+        handler.enqueue_file(test_file, rearm=True)
+        batch = [await handler.processing_queue.get()]
+        handler.mark_settling(batch)
+        handler.mark_processed(batch)
+        assert handler.processing_queue.empty()
+        
+        # Closed while being checked: queued again once the pass is done
+        handler.enqueue_file(test_file)
+        batch = [await handler.processing_queue.get()]
+        handler.mark_settling(batch)
+        handler.enqueue_file(test_file, rearm=True)
+        assert handler.processing_queue.empty()
+        handler.mark_processed(batch)
+        assert await handler.processing_queue.get() == test_file
+        assert handler.queued_files == {test_file}
+    
+    @pytest.mark.asyncio
+    async def test_enqueue_file_newest_first(self, invoice_processor_service, temp_directories):
+        """Test that newest files are dequeued first and the oldest are shed when full"""
+        handler = InvoiceFileHandler(invoice_processor_service)
+        handler.processing_queue = NewestFirstQueue(maxsize=2)
+        
+        paths = [temp_directories['incoming'] / f'invoice_{i}.jpg' for i in range(3)]
+        for path in paths:
+            handler.enqueue_file(path)
+        
+        assert handler.dropped_files == 1
+        assert paths[0] not in handler.queued_files
+        assert await handler.processing_queue.get() == paths[2]
+        assert await handler.processing_queue.get() == paths[1]
 
 
 class TestFileMonitorService:
@@ -81,7 +139,7 @@ class TestFileMonitorService:
     
     @pytest.mark.asyncio
     async def test_start_monitoring(self, file_monitor_service, temp_directories):
-        """Test starting file monitoring"""
+        """Test starting file monitoring (with a real watchdog observer)"""
         # Start monitoring
         await file_monitor_service.start_monitoring()
         
@@ -95,6 +153,7 @@ class TestFileMonitorService:
         await file_monitor_service.stop_monitoring()
     
     @pytest.mark.asyncio
+    @pytest.mark.usefixtures("fake_observer")
     async def test_stop_monitoring(self, file_monitor_service, temp_directories):
         """Test stopping file monitoring"""
         # Start first
@@ -110,24 +169,19 @@ class TestFileMonitorService:
         assert file_monitor_service.file_handler is None
     
     @pytest.mark.asyncio
-    async def test_process_existing_files(self, file_monitor_service, temp_directories):
+    @pytest.mark.usefixtures("fake_observer")
+    async def test_process_existing_files(self, file_monitor_service, temp_directories, sample_image_bytes):
         """Test processing existing files in incoming folder"""
-        from PIL import Image
-        
         # Create existing files
-        for i in range(2):
-            img = Image.new('RGB', (100, 100), color='white')
-            image_path = temp_directories['incoming'] / f'existing_{i}.jpg'
-            img.save(image_path, 'JPEG')
+        image_paths = [temp_directories['incoming'] / f'existing_{i}.jpg' for i in range(2)]
+        for image_path in image_paths:
+            image_path.write_bytes(sample_image_bytes)
         
-        # Start monitoring (which processes existing files)
+        # Start monitoring (which queues existing files before returning)
         await file_monitor_service.start_monitoring()
         
-        # Wait a bit for processing
-        await asyncio.sleep(0.5)
-        
-        # Check that files were queued
-        assert file_monitor_service.file_handler.processing_queue.qsize() >= 0
+        # Check that files were queued; they stay tracked until their batch is processed
+        assert file_monitor_service.file_handler.queued_files == set(image_paths)
         
         # Cleanup
         await file_monitor_service.stop_monitoring()
@@ -141,6 +195,7 @@ class TestFileMonitorService:
         # Note: This is a simple test since we can't easily test the actual queue
     
     @pytest.mark.asyncio
+    @pytest.mark.usefixtures("fake_observer")
     async def test_start_monitoring_already_running(self, file_monitor_service, temp_directories):
         """Test starting monitoring when already running"""
         # Start monitoring
@@ -164,14 +219,25 @@ class TestFileMonitorService:
         assert file_monitor_service.is_running is False
     
     @pytest.mark.asyncio
-    async def test_process_queue_with_files(self, file_monitor_service, temp_directories):
+    @pytest.mark.usefixtures("fake_observer", "fast_monitor_timings")
+    async def test_process_queue_with_files(self, file_monitor_service, temp_directories, sample_image_bytes):
         """Test processing queue with files"""
-        from PIL import Image
-        
         # Create test file
-        img = Image.new('RGB', (100, 100), color='white')
         image_path = temp_directories['incoming'] / 'queue_test.jpg'
-        img.save(image_path, 'JPEG')
+        image_path.write_bytes(sample_image_bytes)
+        
+        # Signal when the queue worker has processed a file
+        processor_service = file_monitor_service.processor_service
+        original_process_single_file = processor_service.process_single_file
+        done = asyncio.Event()
+        
+        async def process_and_signal(*args, **kwargs):
+            try:
+                return await original_process_single_file(*args, **kwargs)
+            finally:
+                done.set()
+        
+        processor_service.process_single_file = AsyncMock(side_effect=process_and_signal)
         
         # Start monitoring
         await file_monitor_service.start_monitoring()
@@ -180,65 +246,66 @@ class TestFileMonitorService:
         await file_monitor_service.file_handler.processing_queue.put(image_path)
         
         # Wait for processing
-        await asyncio.sleep(2)
+        await asyncio.wait_for(done.wait(), timeout=5)
         
-        # File should be processed (queue should be empty or file should be moved)
-        # Note: Actual processing depends on the mock setup
+        # File should be processed by the queue worker
+        processor_service.process_single_file.assert_awaited()
         
         # Cleanup
         await file_monitor_service.stop_monitoring()
     
     @pytest.mark.asyncio
-    async def test_periodic_processing(self, file_monitor_service, temp_directories):
+    @pytest.mark.usefixtures("fake_observer")
+    async def test_periodic_processing(self, file_monitor_service, test_settings):
         """Test periodic processing functionality"""
         # Mock the processor service to track calls
-        original_process_files = file_monitor_service.processor_service.process_files
-        call_count = 0
-        
-        async def mock_process_files(*args, **kwargs):
-            nonlocal call_count
-            call_count += 1
-            return await original_process_files(*args, **kwargs)
-        
-        file_monitor_service.processor_service.process_files = mock_process_files
-        
-        # Start monitoring
-        await file_monitor_service.start_monitoring()
-        
-        # Wait for at least one periodic processing cycle
-        # Note: This test might be flaky due to timing
-        await asyncio.sleep(2)
-        
-        # Should have called process_files at least once
-        # Note: Exact count depends on timing and configuration
-        
-        # Cleanup
-        await file_monitor_service.stop_monitoring()
+        called = asyncio.Event()
+        process_files = AsyncMock(side_effect=lambda *args, **kwargs: called.set())
+        file_monitor_service.processor_service.process_files = process_files
+        
+        # Run periodic cycles every few milliseconds instead of every second
+        fast_settings = msgspec.structs.replace(test_settings, processing_interval_seconds=0.01)
+        with patch('src.services.file_monitor.settings', fast_settings):
+            # Start monitoring
+            await file_monitor_service.start_monitoring()
+            
+            # Wait for at least one periodic processing cycle
+            await asyncio.wait_for(called.wait(), timeout=5)
+            
+            # Should have called process_files at least once
+            assert process_files.await_count >= 1
+            
+            # Cleanup
+            await file_monitor_service.stop_monitoring()
     
     @pytest.mark.asyncio
-    async def test_error_handling_in_queue_processing(self, file_monitor_service, temp_directories):
+    @pytest.mark.usefixtures("fake_observer", "fast_monitor_timings")
+    async def test_error_handling_in_queue_processing(self, file_monitor_service, temp_directories, sample_image_bytes):
         """Test error handling in queue processing"""
-        # Mock processor to raise exception
-        async def mock_process_single_file(*args, **kwargs):
+        # Mock processor to raise exception, signalling the attempt
+        attempted = asyncio.Event()
+        
+        def fail_attempt(*args, **kwargs):
+            attempted.set()
             raise Exception("Test error")
         
-        file_monitor_service.processor_service.process_single_file = mock_process_single_file
+        process_single_file = AsyncMock(side_effect=fail_attempt)
+        file_monitor_service.processor_service.process_single_file = process_single_file
         
         # Start monitoring
         await file_monitor_service.start_monitoring()
         
         # Create and queue a file
-        from PIL import Image
-        img = Image.new('RGB', (100, 100), color='white')
         image_path = temp_directories['incoming'] / 'error_test.jpg'
-        img.save(image_path, 'JPEG')
+        image_path.write_bytes(sample_image_bytes)
         
         await file_monitor_service.file_handler.processing_queue.put(image_path)
         
         # Wait for processing attempt
-        await asyncio.sleep(1)
+        await asyncio.wait_for(attempted.wait(), timeout=5)
         
         # Service should still be running despite error
+        process_single_file.assert_awaited_with(image_path, False)
         assert file_monitor_service.is_running is True
         
         # Cleanup
@@ -4,18 +4,39 @@ Unit tests for invoice processor service
 import pytest
 import asyncio
 import json
+import os
+from datetime import datetime, timedelta
 from pathlib import Path
 from unittest.mock import Mock, patch, AsyncMock
 
-from src.services.invoice_processor import InvoiceProcessorService
-from src.models import InvoiceData, ProcessingStatus
+from src.services.invoice_processor import InvoiceProcessorService, _find_json_object
+from src.models import InvoiceData, ProcessingResult, ProcessingStatus
 from src.utils.exceptions import AIModelError, FileProcessingError
 
 
+@pytest.fixture(scope="module")
+def prebuilt_results():
+    """Build successful results once for the module, newest first with fixed timestamps"""
+    newest = datetime(2024, 1, 15, 12, 0, 0)
+    results = (
+        ProcessingResult(
+            file_id=f"test{i}",
+            original_filename=f"test{i}.jpg",
+            processed_filename=f"test{i}.json",
+            status=ProcessingStatus.SUCCESS,
+            processing_time=1.5,
+            updated_at=newest - timedelta(hours=i)
+        )
+        for i in range(5)
+    )
+    return {result.file_id: result for result in results}
+
+
 class TestInvoiceProcessorService:
     """Test cases for InvoiceProcessorService"""
     
     @pytest.mark.asyncio
+    @pytest.mark.usefixtures("patched_encoder")
     async def test_process_invoice_image_success(self, invoice_processor_service, sample_image_file, mock_llm):
         """Test successful invoice image processing"""
         # Test processing
@@ -28,15 +49,16 @@ class TestInvoiceProcessorService:
         assert result.total_amount == 100.00
         
         # Verify LLM was called
-        mock_llm.invoke.assert_called_once()
+        mock_llm.ainvoke.assert_awaited_once()
     
     @pytest.mark.asyncio
+    @pytest.mark.usefixtures("patched_encoder")
     async def test_process_invoice_image_invalid_json(self, invoice_processor_service, sample_image_file, mock_llm):
         """Test handling of invalid JSON response from AI model"""
         # Mock invalid JSON response
         mock_response = Mock()
         mock_response.content = "Invalid JSON content"
-        mock_llm.invoke.return_value = mock_response
+        mock_llm.ainvoke.return_value = mock_response
         
         # Test processing
         with pytest.raises(Exception) as exc_info:
@@ -56,6 +78,7 @@ class TestInvoiceProcessorService:
         assert "AI model not available" in str(exc_info.value)
     
     @pytest.mark.asyncio
+    @pytest.mark.usefixtures("patched_encoder")
     async def test_process_single_file_success(self, invoice_processor_service, sample_image_file, temp_directories):
         """Test successful single file processing"""
         # Process file
@@ -76,13 +99,31 @@ class TestInvoiceProcessorService:
         moved_files = list(temp_directories['generated'].glob("*.jpg"))
         assert len(moved_files) == 1
     
+    @pytest.mark.asyncio
+    @pytest.mark.usefixtures("patched_encoder")
+    async def test_process_single_file_duplicate_content(self, invoice_processor_service, sample_image_file, temp_directories, mock_llm):
+        """Test that a copy of an already processed file reuses the extracted data"""
+        duplicate_file = temp_directories['incoming'] / 'duplicate_invoice.jpg'
+        duplicate_file.write_bytes(sample_image_file.read_bytes())
+        
+        # Process both files
+        first = await invoice_processor_service.process_single_file(sample_image_file)
+        second = await invoice_processor_service.process_single_file(duplicate_file)
+        
+        # Assertions
+        assert first.status == ProcessingStatus.SUCCESS
+        assert second.status == ProcessingStatus.SUCCESS
+        assert second.invoice_data == first.invoice_data
+        assert mock_llm.ainvoke.call_count == 1
+        assert not duplicate_file.exists()
+    
     @pytest.mark.asyncio
     async def test_process_single_file_large_file(self, invoice_processor_service, temp_directories):
         """Test processing of file that exceeds size limit"""
-        # Create a large dummy file
+        # Create a large dummy file (sparse, so no data is actually written)
         large_file = temp_directories['incoming'] / 'large_file.jpg'
-        with open(large_file, 'wb') as f:
-            f.write(b'0' * (15 * 1024 * 1024))  # 15MB file
+        large_file.touch()
+        os.truncate(large_file, 15 * 1024 * 1024)  # 15MB file
         
         # Process file
         result = await invoice_processor_service.process_single_file(large_file)
@@ -92,15 +133,13 @@ class TestInvoiceProcessorService:
         assert "exceeds maximum allowed size" in result.error_message
     
     @pytest.mark.asyncio
-    async def test_process_files_batch(self, invoice_processor_service, temp_directories):
+    @pytest.mark.usefixtures("patched_encoder")
+    async def test_process_files_batch(self, invoice_processor_service, temp_directories, sample_image_bytes):
         """Test batch processing of multiple files"""
-        from PIL import Image
-        
         # Create multiple test images
         for i in range(3):
-            img = Image.new('RGB', (100, 100), color='white')
             image_path = temp_directories['incoming'] / f'test_invoice_{i}.jpg'
-            img.save(image_path, 'JPEG')
+            image_path.write_bytes(sample_image_bytes)
         
         # Process files
         await invoice_processor_service.process_files()
@@ -117,32 +156,47 @@ class TestInvoiceProcessorService:
         assert len(incoming_files) == 0
     
     @pytest.mark.asyncio
-    async def test_get_statistics(self, invoice_processor_service):
-        """Test statistics retrieval"""
-        # Add some mock results
-        from src.models import ProcessingResult
-        from src.utils.helpers import generate_file_id
-        
-        # Add successful result
-        result1 = ProcessingResult(
-            file_id=generate_file_id("test1.jpg"),
-            original_filename="test1.jpg",
-            processed_filename="test1.json",
-            status=ProcessingStatus.SUCCESS,
-            processing_time=1.5
-        )
+    @pytest.mark.usefixtures("patched_encoder")
+    async def test_process_files_bounds_files_in_flight(self, invoice_processor_service, temp_directories, test_settings, mock_llm):
+        """Test that a large backlog is processed at most batch_size files at a time"""
+        # Distinct content, so every file needs the model
+        for i in range(test_settings.batch_size * 2):
+            (temp_directories['incoming'] / f'backlog_{i}.jpg').write_bytes(b'invoice %d' % i)
+        
+        in_flight = []
+        response = mock_llm.ainvoke.return_value
+        
+        async def record_in_flight(*args, **kwargs):
+            in_flight.append(sum(
+                1 for result in invoice_processor_service.processing_results.values()
+                if result.status == ProcessingStatus.PROCESSING
+            ))
+            await asyncio.sleep(0)
+            return response
         
-        # Add failed result
-        result2 = ProcessingResult(
-            file_id=generate_file_id("test2.jpg"),
-            original_filename="test2.jpg",
+        mock_llm.ainvoke.side_effect = record_in_flight
+        
+        # Process files
+        await invoice_processor_service.process_files()
+        
+        # Assertions
+        assert mock_llm.ainvoke.await_count == test_settings.batch_size * 2
+        assert max(in_flight) <= test_settings.batch_size
+    
+    @pytest.mark.asyncio
+    async def test_get_statistics(self, invoice_processor_service, prebuilt_results):
+        """Test statistics retrieval"""
+        # Add some mock results: successful ones plus a failed one
+        failed_result = ProcessingResult(
+            file_id="failed",
+            original_filename="failed.jpg",
             processed_filename="",
             status=ProcessingStatus.FAILED,
             error_message="Test error"
         )
         
-        invoice_processor_service.processing_results[result1.file_id] = result1
-        invoice_processor_service.processing_results[result2.file_id] = result2
+        invoice_processor_service.processing_results.update(prebuilt_results)
+        invoice_processor_service.processing_results[failed_result.file_id] = failed_result
         
         # Get statistics
         stats = await invoice_processor_service.get_statistics()
@@ -154,22 +208,10 @@ class TestInvoiceProcessorService:
         assert stats.average_processing_time == 1.5  # Only successful results count
     
     @pytest.mark.asyncio
-    async def test_get_recent_results(self, invoice_processor_service):
+    async def test_get_recent_results(self, invoice_processor_service, prebuilt_results):
         """Test recent results retrieval"""
-        from src.models import ProcessingResult
-        from src.utils.helpers import generate_file_id
-        from datetime import datetime, timedelta
-        
         # Add results with different timestamps
-        for i in range(5):
-            result = ProcessingResult(
-                file_id=generate_file_id(f"test{i}.jpg"),
-                original_filename=f"test{i}.jpg",
-                processed_filename=f"test{i}.json",
-                status=ProcessingStatus.SUCCESS,
-                updated_at=datetime.utcnow() - timedelta(hours=i)
-            )
-            invoice_processor_service.processing_results[result.file_id] = result
+        invoice_processor_service.processing_results.update(prebuilt_results)
         
         # Get recent results
         recent_results = await invoice_processor_service.get_recent_results(limit=3)
@@ -182,20 +224,11 @@ class TestInvoiceProcessorService:
         assert recent_results[2].original_filename == "test2.jpg"
     
     @pytest.mark.asyncio
-    async def test_delete_result(self, invoice_processor_service):
+    async def test_delete_result(self, invoice_processor_service, prebuilt_results):
         """Test result deletion"""
-        from src.models import ProcessingResult
-        from src.utils.helpers import generate_file_id
-        
-        # Add a result
-        file_id = generate_file_id("test.jpg")
-        result = ProcessingResult(
-            file_id=file_id,
-            original_filename="test.jpg",
-            processed_filename="test.json",
-            status=ProcessingStatus.SUCCESS
-        )
-        invoice_processor_service.processing_results[file_id] = result
+        # Add the results
+        invoice_processor_service.processing_results.update(prebuilt_results)
+        file_id = "test0"
         
         # Delete result
         success = await invoice_processor_service.delete_result(file_id)
@@ -232,4 +265,12 @@ class TestInvoiceProcessorService:
         assert "invoice_number" in prompt
         assert "JSON" in prompt
         assert "extract" in prompt.lower()
-
+    
+    def test_find_json_object(self):
+        """Test extracting a nested JSON object from surrounding text"""
+        text = 'Here you go: {"a": {"b": [{"c": "}"}]}, "d": "\\"{"} trailing {x}'
+        
+        # Assertions
+        assert json.loads(_find_json_object(text)) == {"a": {"b": [{"c": "}"}]}, "d": "\"{"}
+        assert _find_json_object("no json here") is None
+        assert _find_json_object('{"unclosed": {') is None